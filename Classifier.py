@@ -1,8 +1,25 @@
 from FeatureExplorer import *
+from FeatureCache import PatientCache
+from FeatureCache import CacheDir
+from ClipStore import ClipStore
+from ClipStore import HasStore
+from ClipStore import reSegment
+from FeatureTable import LoadTable
+from FeatureTable import TablePath
+from FeatureTable import TableResampling
+from FeatureTable import TablePatients
+from KNNEngine import KNNModel
+from ModelArtifact import PatientModel
+from RunManifest import RunManifest
+from Resampler import LoadResampledClip
+from Resampler import ResampledCacheDir
+
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 import scipy.io as sio
 import numpy as np
+import functools
 import string
 import time
 import os
@@ -10,101 +27,162 @@ import os
 trainingdir = "E:/training results 5/"
 testingdir = "E:/DATA/"
 outputfile = "E:/testing results/training5.txt"
-f = open(outputfile, 'w')
+cachedir = CacheDir    # feature caches, shared with Trainer.py and FeatureExplorer.py (set CacheDir in FeatureCache.py)
+storedir = None    # folder of packed clip stores (ClipStore.py), None to read the .mat files
+modeldir = None    # folder of compiled models (ModelArtifact.py), None to build the models from the tables every run
+batchsize = 256
+loadthreads = 4      # threads reading the next test clips while a batch is featurized
+maxinflight = 256    # most test clips read ahead at once
+computedtype = np.float64     # np.float32 halves the memory traffic of feature extraction; checked against float64 on every patient
+workers = os.cpu_count()      # processes classifying patients (or chunks of a patient's test clips) in parallel
+chunksize = 1024     # most test clips classified by one process task
+# kNN settings (see KNNEngine.py): neighbours, padding distance, 'euclidean'/'manhattan'/'scaled'
+# metric, 'uniform'/'distance' vote weighting, Eps > 0 for approximate search, and the per-feature
+# divisors of the scaled metric (None: the std dev of the training points)
+knnsettings = {'K': 10, 'Pad': 100.0, 'Metric': 'euclidean', 'Weighting': 'uniform', 'Eps': 0.0, 'Scale': None}
+# resample every test clip to resamplefreq in memory as it is read (Resampler.py mode resamplemode), instead of
+# classifying a copy written by Resampler.py; None classifies the clips as they are.  Either way the clips must come
+# out at the filter bank's NativeFreq, which the features are tuned for (see CheckClipFreq() in FeatureExplorer.py).  resampledir also writes the
+# resampled clips there, one folder per patient, None keeps them in memory only.  Resampled clips are read from
+# the .mat files rather than the packed stores, and their features are cached apart
+resamplefreq = None
+resamplemode = 'fft'
+resampledir = None
+# how the clips are resampled, checked against the training points and the manifest (see FeatureTable.py)
+resampling = None if resamplefreq is None else [resamplefreq, resamplemode]
+resume = True        # continue an interrupted run from its manifest (RunManifest.py) and append to the output; False starts over
 
-for dn in os.listdir(trainingdir):
-    
-    # load classified points
-    ipoints = []
-    epoints = []
-    lpoints = []
-    trainingpath = os.path.join(trainingdir, dn)
-    if "Store" not in dn:
-        for fn in os.listdir(trainingpath):
-            if "test" not in fn:
-                trainingfile = os.path.join(trainingpath, fn)
-                point = sio.loadmat(trainingfile)
-                if point['type'] == 'i':
-                    ipoints.append(point['data'].tolist())
-                elif point['type'] == 'e':
-                    epoints.append(point['data'].tolist())
-                elif point['type'] == 'l':
-                    lpoints.append(point['data'].tolist())
-                else:
-                    print("Invalid point type.")
+
+# kNN model of every patient, by patient folder name: built once in the main process and handed
+# to the pool workers when they start (see SetModels()), or, with modeldir, mapped by each worker
+# from the compiled model the main process brought up to date
+models = {}
+
+
+#
+# SetModels()
+# Process pool initializer: take the models built by the main process
+def SetModels(patientmodels):
+    models.update(patientmodels)
+
+
+#
+# PatientKNN()
+# kNN model of one patient: the compiled model, or the classified points (the whole feature
+# table in one read) indexed for nearest neighbour queries
+def PatientKNN(dn):
+    if modeldir is not None:
+        model, modelconfig = PatientModel(trainingdir, dn, modeldir, **knnsettings)
+        tablefeatures = modelconfig['features']
+        tableresampling = modelconfig.get('resampling')
+    else:
+        table, tablefeatures = LoadTable(TablePath(trainingdir, dn))
+        tableresampling = TableResampling(TablePath(trainingdir, dn))
+        model = KNNModel(table['data'], table['label'], **knnsettings)
+    if list(tablefeatures) != list(ModelFeatures):
+        raise ValueError('The training points of ' + dn + ' were made with other features: ' + str(tablefeatures))
+    if tableresampling != resampling:
+        raise ValueError('The training points of ' + dn + ' were made with other resampling: ' + str(tableresampling))
+    return(model)
+
+
+#
+# PatientLoad()
+# Clip loader of one patient's test clips: LoadClip(), or LoadResampledClip() when resampling
+def PatientLoad(dn):
+    if resamplefreq is None:
+        return(LoadClip)
+    return(functools.partial(LoadResampledClip, Outfreq=resamplefreq, Mode=resamplemode,
+                             SaveDir=None if resampledir is None else os.path.join(resampledir, dn)))
+
+
+#
+# ClassifyChunk()
+# Process pool task: featurize a chunk of one patient's test clips in batches, going through
+# the patient's feature cache, and classify them all at once.  Returns (fn, ictal, early) for
+# every clip: the share of the votes of the nearest training points that are ictal, and
+# that are early ictal
+def ClassifyChunk(dn, testfns):
+    SetComputeDtype(computedtype)
+    if dn not in models:
+        models[dn] = PatientKNN(dn)
+    model = models[dn]
     
-    # classify new points
     testingpath = os.path.join(testingdir, dn)
-    print(testingpath)
-    for fn in os.listdir(testingpath):
-        if "test" in fn:
-            print(fn)
-            testname = os.path.join(testingpath, fn)
-            PD, is_early = PeakDetect(testname)
-            dCPD = difChannelPeakDeviation(testname)[0]
-            #dPD = difPeakDetect(testname)
-            BPF = TenTwentyBPF(testname)
-    
-            f1 = np.mean(PD)
-            f2 = dCPD
-            f3 = np.mean(BPF)
-    
-            point = [f1, f2, f3]
+    if resamplefreq is None:
+        cache = PatientCache(testingpath, cachedir)
+    else:
+        cache = PatientCache(testingpath, ResampledCacheDir(cachedir, resamplefreq, resamplemode))
+    store = None
+    if storedir is not None and resamplefreq is None and HasStore(storedir, dn):
+        store = ClipStore(storedir, dn)
+    testpoints = []
+    for batchpaths, features, latencies in FeatureBatches(ModelFeatures,
+                                                          [os.path.join(testingpath, fn) for fn in testfns],
+                                                          batchsize, cache, store,
+                                                          loadthreads, maxinflight, PatientLoad(dn)):
+        testpoints.extend(SummarizeFeatures(features, ModelFeatures).tolist())
+    cache.Close()
     
-            i_neighbors = []
-            for i in ipoints:
-                dist = ((f1 - i[0][0])**2 + (f2 - i[0][1])**2 + (f3 - i[0][2])**2)**0.5
-                i_neighbors.append(dist)
+    ictals, earlies = model.Probabilities(np.array(testpoints))
+    return(list(zip(testfns, ictals.tolist(), earlies.tolist())))
+
+
+if __name__ == '__main__':
     
-            e_neighbors = []
-            for i in epoints:
-                dist = ((f1 - i[0][0])**2 + (f2 - i[0][1])**2 + (f3 - i[0][2])**2)**0.5
-                e_neighbors.append(dist)
+    # build (or compile and check) every patient's model once, before the workers use it
+    patients = TablePatients(trainingdir)
+    for dn in patients:
+        models[dn] = PatientKNN(dn)
     
-            l_neighbors = []
-            for i in lpoints:
-                dist = ((f1 - i[0][0])**2 + (f2 - i[0][1])**2 + (f3 - i[0][2])**2)**0.5
-                l_neighbors.append(dist)
+    # progress of an interrupted run: the test clips already written for each
+    # patient, and the length of the output file once they were flushed
+    manifest = RunManifest(outputfile + ".manifest.json", Fresh=not resume)
+    if manifest.Get('output', 0) and manifest.Get('resampling') != resampling:
+        raise ValueError('The interrupted run was made with other resampling: ' + str(manifest.Get('resampling')) +
+                         ' (set resume = False to start over)')
     
-            ins = sorted(i_neighbors)[:]
-            while len(ins) < 10:
-                ins.append(100)
-            ens = sorted(e_neighbors)[:]
-            while len(ens) < 10:
-                ens.append(100)
-            lns = sorted(l_neighbors)[:]
-            while len(lns) < 10:
-                lns.append(100)
+    # append to the output, dropping anything written after the last recorded flush;
+    # the clips it still lists are the ones an earlier run finished
+    f = open(outputfile, 'a')
+    f.truncate(manifest.Get('output', 0))
+    with open(outputfile) as donefile:
+        finished = set(line.split(',')[0] for line in donefile)
     
-            i = 0.0
-            e = 0.0
-            l = 0.0
+    # shard the patients, and the test clips of large patients, across the pool,
+    # leaving out the finished clips (new clips may sort among them)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=SetModels,
+                                   initargs=({} if modeldir is not None else models,))
+    tasks = []
+    for dn in patients:
+        testfns = sorted(fn for fn in os.listdir(os.path.join(testingdir, dn)) if reSegment.match(fn) and "test" in fn)
+        doneclips = sum(fn in finished for fn in testfns)
+        testfns = [fn for fn in testfns if fn not in finished]
+        if testfns:
+            CheckClipFreq(os.path.join(testingdir, dn, testfns[0]), PatientLoad(dn))
+        if np.dtype(computedtype) != np.float64 and testfns:
+            CheckClipDtype(ModelFeatures, [os.path.join(testingdir, dn, fn) for fn in testfns], computedtype, PatientLoad(dn))
+        for first in range(0, len(testfns), chunksize):
+            tasks.append((dn, doneclips + first, executor.submit(ClassifyChunk, dn, testfns[first:first + chunksize])))
     
-            for j in range(0, 10):
-                if ins[0] < ens[0]:
-                    if ins[0] < lns[0]:
-                        i += 1.0
-                        ins.pop(0)
-                    else:
-                        l += 1.0
-                        lns.pop(0)
-                else:
-                    if ens[0] < lns[0]:
-                        e += 1.0
-                        ens.pop(0)
-                    else:
-                        l += 1.0
-                        lns.pop(0)
-            
-            ictal = 1.0 - i/10.0
-            early = e/10.0
+    # write the results in patient then clip order, whatever order the tasks finish in,
+    # and record each chunk once it is on disk
+    lastdn = None
+    for dn, first, task in tasks:
+        if dn != lastdn:
+            print(os.path.join(testingdir, dn))
+            lastdn = dn
+        results = task.result()
+        for fn, ictal, early in results:
+            print(fn)
             f.write(fn)
             f.write(',')
             f.write("{0:.1f}".format(ictal))
             f.write(",{0:.1f}\n".format(early))
-
-print("\nClassification complete.")
-f.close()
-            
+        f.flush()
+        os.fsync(f.fileno())
+        manifest.Record(dn, first + len(results), output=f.tell(), resampling=resampling)
+    executor.shutdown()
     
-    
\ No newline at end of file
+    print("\nClassification complete.")
+    f.close()
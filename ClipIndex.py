@@ -0,0 +1,165 @@
+"""
+ClipIndex.py: Per-directory metadata index of clip files.
+
+For every <patient>_<type>_segment_<n>.mat file in a directory the index records
+the clip type (ictal, interictal or test), its class (interictal, early, late or
+test, see ClipClass()), segment number, channel count, sample count, sampling
+frequency and latency (None when the clip has none), so tools can sort clips
+into interictal/early/late and discover the channel layout without loading any
+clip data.
+
+The index is kept as a JSON file in an index folder (not in the data directory,
+where it would be taken for a clip).  Opening a ClipIndex refreshes it
+incrementally: only files that are new, or whose size or modification time
+changed, are read, and then only their headers and the small freq/latency
+variables.  Entries of deleted files are dropped.
+
+    Index = ClipIndex('E:/DATA/Dog_1')
+    for FileName, Entry in Index.Entries('ictal'):
+        print(FileName, Entry['latency'])
+"""
+
+import os
+import json
+import hashlib
+
+import scipy.io as spio
+
+from ClipStore import reSegment
+from ClipStore import ClipTypes
+
+
+# Default folder for the index files
+IndexDir = os.path.join(os.path.expanduser('~'), '.clipindex')
+
+# Ictal clips with a latency below this many seconds are early ictal
+EarlyLatency = 16
+
+
+#####################################################################################
+# Clip Index Class
+#####################################################################################
+class ClipIndex():
+
+    #
+    # Class constructor, loads the index of DirPath and brings it up to date
+    #
+    def __init__(self, DirPath, IndexFolder=IndexDir):
+        self.DirPath = DirPath
+        self.IndexPath = IndexPath(DirPath, IndexFolder)
+        self.Index = {}                                 #File name -> entry dict
+        if os.path.isfile(self.IndexPath):
+            with open(self.IndexPath) as IndexFile:
+                self.Index = json.load(IndexFile)
+        self.Refresh()
+
+    #
+    # Refresh(): index new and changed clip files, forget deleted ones, and save the index if
+    # anything changed.  Returns the number of files that had to be read
+    #
+    def Refresh(self):
+        Read = 0
+        Seen = set()
+        for FileName in os.listdir(self.DirPath):
+            Match = reSegment.match(FileName)
+            if not Match:
+                continue
+            Seen.add(FileName)
+            Stat = os.stat(os.path.join(self.DirPath, FileName))
+            Entry = self.Index.get(FileName)
+            if Entry is not None and Entry['size'] == Stat.st_size and Entry['mtime'] == Stat.st_mtime:
+                continue
+            self.Index[FileName] = ReadEntry(os.path.join(self.DirPath, FileName), Match, Stat)
+            Read += 1
+
+        Deleted = [FileName for FileName in self.Index if FileName not in Seen]
+        for FileName in Deleted:
+            del self.Index[FileName]
+
+        if Read or Deleted or not os.path.isfile(self.IndexPath):
+            self.Save()
+        return(Read)
+
+    #
+    # Save(): write the index file, replacing the old one in a single step
+    #
+    def Save(self):
+        os.makedirs(os.path.dirname(self.IndexPath), exist_ok=True)
+        TempPath = self.IndexPath + '.tmp'
+        with open(TempPath, 'w') as IndexFile:
+            json.dump(self.Index, IndexFile)
+        os.replace(TempPath, self.IndexPath)
+
+    #
+    # Get(): entry of one clip file, None if it is not indexed
+    #
+    def Get(self, FileName):
+        return(self.Index.get(os.path.basename(FileName)))
+
+    #
+    # Entries(): (FileName, Entry) pairs ordered by type then segment number, optionally
+    # only those of one type
+    #
+    def Entries(self, Type=None):
+        Pairs = [(FileName, Entry) for FileName, Entry in self.Index.items() if Type is None or Entry['type'] == Type]
+        Pairs.sort(key=lambda Pair: (ClipTypes.index(Pair[1]['type']), Pair[1]['segment']))
+        return(Pairs)
+
+    #
+    # Classes(): (FileName, Entry) pairs of one class ('interictal', 'early', 'late' or 'test')
+    #
+    def Classes(self, Class):
+        return([(FileName, Entry) for FileName, Entry in self.Entries() if Entry['class'] == Class])
+
+    #
+    # Channels(): channel count of the clips (taken from the first indexed clip), None if empty
+    #
+    def Channels(self):
+        Pairs = self.Entries()
+        if not Pairs:
+            return(None)
+        return(Pairs[0][1]['channels'])
+
+
+#
+# IndexPath()
+# Index file of a directory: named after the directory, made unique by a hash of its full path
+def IndexPath(DirPath, IndexFolder=IndexDir):
+    FullDir = os.path.abspath(DirPath)
+    Digest = hashlib.md5(FullDir.encode('utf-8')).hexdigest()[:8]
+    return(os.path.join(IndexFolder, os.path.basename(os.path.normpath(FullDir)) + '_' + Digest + '.json'))
+
+
+#
+# ReadEntry()
+# Index entry of one clip file.  Only the header of the data variable and the small
+# freq/latency variables are read
+def ReadEntry(FullPath, Match, Stat):
+    Shapes = dict((Name, Shape) for Name, Shape, Class in spio.whosmat(FullPath))
+    Small = spio.loadmat(FullPath, variable_names=['freq', 'latency'])
+
+    Latency = None
+    if 'latency' in Small.keys():
+        Latency = float(Small['latency'])
+
+    return({'type': Match.group(2),
+            'class': ClipClass(Match.group(2), Latency),
+            'segment': int(Match.group(3)),
+            'channels': int(Shapes['data'][0]),
+            'samples': int(Shapes['data'][1]),
+            'freq': float(Small['freq']),
+            'latency': Latency,
+            'size': Stat.st_size,
+            'mtime': Stat.st_mtime})
+
+
+#
+# ClipClass()
+# Class of a clip from its type and latency: 'interictal', 'test', or 'early'/'late' for
+# ictal clips
+def ClipClass(Type, Latency):
+    if Type != 'ictal':
+        return(Type)
+    if Latency is not None and Latency < EarlyLatency:
+        return('early')
+    return('late')
@@ -0,0 +1,94 @@
+"""
+ClipLoader.py: Prefetching clip loader.
+
+A PrefetchLoader reads and decodes the clips of a list of files on a small
+background thread pool, ahead of the code consuming them, so that reading the
+next clips from disk (or a network drive) overlaps the feature computation of
+the current ones.  At most MaxInFlight clips are being read or waiting to be
+consumed at any time, which bounds the memory used, and results always come
+out in the order of the file list.
+
+    with PrefetchLoader(FullPaths, LoadClip) as Loader:
+        for FullPath, (DataArray, Fsample, Latency) in Loader:
+            ...
+
+Get() takes the clips one at a time instead, by name, for code such as
+FeatureExplorer.LoadFeatures() that asks for a subsequence of the list; see
+FeatureExplorer.FeatureBatches().
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+#####################################################################################
+# Prefetch Loader Class
+#####################################################################################
+class PrefetchLoader():
+
+    #
+    # Class constructor.  Items are the (distinct) names passed to Load, typically clip paths;
+    # Load is called on the thread pool and its result is handed back in Items order
+    #
+    def __init__(self, Items, Load, Workers=4, MaxInFlight=16):
+        if Workers < 1 or MaxInFlight < 1:
+            raise ValueError('Workers and MaxInFlight must be at least 1')
+        self.Items = list(Items)
+        self.Load = Load
+        self.MaxInFlight = MaxInFlight
+        self.Executor = ThreadPoolExecutor(max_workers=Workers)
+        self.InFlight = collections.deque()     #(Item, Future) of the submitted loads, in Items order
+        self.Next = 0                           #Index in Items of the next load to submit
+        self.Unread = set(self.Items)           #Items not handed back yet
+        self.Fill()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *Exc):
+        self.Close()
+
+    #
+    # Fill(): submit loads until MaxInFlight are in flight or every item has been submitted
+    #
+    def Fill(self):
+        while len(self.InFlight) < self.MaxInFlight and self.Next < len(self.Items):
+            Item = self.Items[self.Next]
+            self.InFlight.append((Item, self.Executor.submit(self.Load, Item)))
+            self.Next += 1
+
+    #
+    # Take(): hand back the oldest load, waiting for it to finish.  Errors raised by Load are
+    # raised here, in order
+    #
+    def Take(self):
+        Item, Future = self.InFlight.popleft()
+        self.Unread.discard(Item)
+        self.Fill()
+        return(Item, Future.result())
+
+    def __iter__(self):
+        while self.InFlight:
+            yield(self.Take())
+
+    #
+    # Get(): the loaded result of one item.  Items skipped over since the last call are dropped;
+    # an item that is not (or no longer) in the list is loaded directly
+    #
+    def Get(self, Item):
+        if Item not in self.Unread:
+            return(self.Load(Item))
+        while True:
+            Taken, Result = self.Take()
+            if Taken == Item:
+                return(Result)
+
+    #
+    # Close(): cancel the loads that have not started and release the threads
+    #
+    def Close(self):
+        for Item, Future in self.InFlight:
+            Future.cancel()
+        self.InFlight.clear()
+        self.Unread.clear()
+        self.Executor.shutdown(wait=True)
@@ -0,0 +1,184 @@
+"""
+ClipStore.py: Consolidated, memory-mapped per-patient clip store.
+
+PackPatient() converts a patient directory of <patient>_<type>_segment_<n>.mat
+files into two files in a store folder:
+
+    <patient>.npy       every clip's 'data' array stacked into one contiguous
+                        (clips, channels, samples) array
+    <patient>_meta.npy  one record per clip: segment number, type (ictal,
+                        interictal or test), latency (NaN when the clip has
+                        none), freq, the original file name and that file's
+                        size and modification time when it was packed
+
+Clips are ordered by type then segment number, so all clips of one type form a
+contiguous block.  ClipStore opens the data file with np.load(mmap_mode='r'):
+nothing is read until a slice is used, slices of it are views (no copy) that
+can be passed straight to FeatureEngine.BatchFeatures(), and the OS page cache
+does the buffering.  A clip whose file has changed since it was packed is not
+served from the store (see ClipStore.Find()); pack the patient again to take it in.
+
+    Store = ClipStore('E:/STORE/', 'Dog_1')
+    Batch = Store.Clips('interictal')                  #(clips, channels, samples) view
+"""
+
+import os
+import re
+
+import numpy as np
+import scipy.io as spio
+
+
+# Clip file names: <patient>_<type>_segment_<n>.mat
+reSegment = re.compile(r'^(.+)_(ictal|interictal|test)_segment_(\d+)\.mat$')
+
+# Order of the clip types in a store
+ClipTypes = ('ictal', 'interictal', 'test')
+
+# Record layout of the metadata table
+MetaDtype = np.dtype([('segment', np.int32), ('type', 'U10'), ('latency', np.float64), ('freq', np.float64), ('filename', 'U64'),
+                      ('size', np.int64), ('mtime', np.float64)])
+
+
+#####################################################################################
+# Clip Store Class
+#####################################################################################
+class ClipStore():
+
+    #
+    # Class constructor, memory-maps the store of Patient in StoreDir
+    #
+    def __init__(self, StoreDir, Patient):
+        DataPath, MetaPath = StorePaths(StoreDir, Patient)
+        self.Patient = Patient
+        self.Data = np.load(DataPath, mmap_mode='r')            #(clips, channels, samples), read on demand
+        self.Meta = np.load(MetaPath)                           #One MetaDtype record per clip
+        self.Index = dict((FileName, k) for k, FileName in enumerate(self.Meta['filename']))
+
+    def __len__(self):
+        return(self.Data.shape[0])
+
+    #
+    # Select(): slice covering the clips of one type
+    #
+    def Select(self, Type):
+        Rows = np.flatnonzero(self.Meta['type'] == Type)
+        if Rows.size == 0:
+            return(slice(0, 0))
+        return(slice(Rows[0], Rows[-1] + 1))
+
+    #
+    # Clips(): (clips, channels, samples) view of all clips of one type
+    #
+    def Clips(self, Type):
+        return(self.Data[self.Select(Type)])
+
+    #
+    # Clip(): one clip as (DataArray, Fsample, Latency), like FeatureExplorer.LoadClip()
+    #
+    def Clip(self, k):
+        Latency = float(self.Meta['latency'][k])
+        if np.isnan(Latency):
+            Latency = None
+        return(self.Data[k], float(self.Meta['freq'][k]), Latency)
+
+    #
+    # Find(): row of the clip stored from FileName, None if the store does not have it.  When
+    # FileName is an existing file, None too if its size or modification time is not that of
+    # the packed file (the clip has changed since, or the store predates those fields)
+    #
+    def Find(self, FileName):
+        Row = self.Index.get(os.path.basename(FileName))
+        if Row is None or not os.path.isfile(FileName):
+            return(Row)
+        if 'mtime' not in self.Meta.dtype.names:
+            return(None)
+        Stat = os.stat(FileName)
+        if self.Meta['size'][Row] != Stat.st_size or self.Meta['mtime'][Row] != Stat.st_mtime:
+            return(None)
+        return(Row)
+
+    #
+    # Concatenated(): the clips of one type joined end to end into one (channels, samples) array
+    #
+    def Concatenated(self, Type):
+        Clips = self.Clips(Type)
+        return(Clips.transpose(1, 0, 2).reshape(Clips.shape[1], -1))
+
+
+#
+# StorePaths()
+# Data and metadata file names of a patient's store
+def StorePaths(StoreDir, Patient):
+    return(os.path.join(StoreDir, Patient + '.npy'), os.path.join(StoreDir, Patient + '_meta.npy'))
+
+
+#
+# HasStore()
+# True if StoreDir holds a store for Patient
+def HasStore(StoreDir, Patient):
+    DataPath, MetaPath = StorePaths(StoreDir, Patient)
+    return(os.path.isfile(DataPath) and os.path.isfile(MetaPath))
+
+
+#
+# PackPatient()
+# Pack every clip file in PatientDir into a store in StoreDir.  The data file is written
+# through a memory map one clip at a time, so the patient never has to fit in memory.
+# Returns the number of clips packed
+def PackPatient(PatientDir, StoreDir):
+    Patient = os.path.basename(os.path.normpath(PatientDir))
+
+    # Enumerate the clip files, ordered by type then segment number
+    Entries = []
+    for FileName in os.listdir(PatientDir):
+        Match = reSegment.match(FileName)
+        if Match:
+            Entries.append((ClipTypes.index(Match.group(2)), int(Match.group(3)), Match.group(2), FileName))
+    Entries.sort()
+    if not Entries:
+        raise ValueError('No clip files found in ' + PatientDir)
+
+    os.makedirs(StoreDir, exist_ok=True)
+    DataPath, MetaPath = StorePaths(StoreDir, Patient)
+    Meta = np.zeros(len(Entries), dtype=MetaDtype)
+    Data = None
+
+    for k, (TypeOrder, Segment, Type, FileName) in enumerate(Entries):
+        Stat = os.stat(os.path.join(PatientDir, FileName))
+        TempClipData = spio.loadmat(os.path.join(PatientDir, FileName))
+        DataArray = TempClipData['data']
+
+        if Data is None:
+            Data = np.lib.format.open_memmap(DataPath, mode='w+', dtype=DataArray.dtype, shape=(len(Entries),) + DataArray.shape)
+        elif DataArray.shape != Data.shape[1:]:
+            raise ValueError('%s is shaped %s, the other clips are %s' % (FileName, DataArray.shape, Data.shape[1:]))
+        Data[k] = DataArray
+
+        Latency = np.nan
+        if 'latency' in TempClipData.keys():
+            Latency = float(TempClipData['latency'])
+        Meta[k] = (Segment, Type, Latency, float(TempClipData['freq']), FileName, Stat.st_size, Stat.st_mtime)
+
+    Data.flush()
+    del Data
+    np.save(MetaPath, Meta)
+    return(len(Entries))
+
+
+#
+# PackAll()
+# Pack every patient directory under DataDir into StoreDir
+def PackAll(DataDir, StoreDir):
+    for dn in os.listdir(DataDir):
+        PatientDir = os.path.join(DataDir, dn)
+        if os.path.isdir(PatientDir) and 'Store' not in dn:
+            print('Packed', PackPatient(PatientDir, StoreDir), 'clips of', dn)
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3:
+        print('Usage: python ClipStore.py <data folder> <store folder>')
+        sys.exit(1)
+    PackAll(sys.argv[1], sys.argv[2])
@@ -1,5 +1,6 @@
 # Data viewer for kaggle competition (concat)
 
+import os
 import sys
 from PyQt4 import QtGui
 
@@ -14,8 +15,62 @@ import tkinter
 from tkinter.filedialog import askdirectory
 import random
 
+from ClipStore import ClipStore
+from ClipStore import HasStore
+from ClipIndex import ClipIndex
+
 colors = ['b-', 'g-', 'r-', 'c-', 'm-', 'y-', 'k-', 'w-']
 
+# sampling frequency of the displayed data
+freq = 400
+
+# the coarsest envelope level keeps at least this many blocks
+min_blocks = 1024
+
+
+#
+# envelope_pyramid()
+# min/max envelopes of one channel's samples at block sizes 1, 2, 4, 8, ...: a list of
+# (mins, maxs) pairs, level k holding the min and max of every block of 2**k samples (level 0
+# is the samples themselves).  Halving stops at about min_blocks blocks
+def envelope_pyramid(samples, min_blocks=min_blocks):
+    levels = [(samples, samples)]
+    mins, maxs = samples, samples
+    while len(mins) > 2 * min_blocks:
+        pairs = np.arange(0, len(mins), 2)
+        mins = np.minimum.reduceat(mins, pairs)
+        maxs = np.maximum.reduceat(maxs, pairs)
+        levels.append((mins, maxs))
+    return(levels)
+
+
+#
+# envelope_level()
+# pyramid level drawing span samples across pixels pixels with about two blocks per pixel
+# at most: the coarsest level whose blocks are no wider than span/pixels samples
+def envelope_level(levels, span, pixels):
+    level = int(np.log2(max(span / max(pixels, 1), 1)))
+    return(min(level, len(levels) - 1))
+
+
+#
+# envelope_points()
+# x (seconds) and y of samples first to last at one pyramid level: the samples themselves at
+# level 0, otherwise every block's min then max, so a spike shows whatever the zoom
+def envelope_points(levels, level, first, last):
+    mins, maxs = levels[level]
+    block = 2 ** level
+    lo = first // block
+    hi = min(-(-last // block), len(mins))
+    if level == 0:
+        return(np.arange(lo, hi) / freq, mins[lo:hi])
+    x = np.repeat(np.arange(lo, hi) * block / freq, 2)
+    y = np.empty(2 * (hi - lo), dtype=mins.dtype)
+    y[0::2] = mins[lo:hi]
+    y[1::2] = maxs[lo:hi]
+    return(x, y)
+
+
 class Window(QtGui.QDialog):
     def __init__(self, parent = None):
         super(Window, self).__init__(parent)
@@ -26,6 +81,10 @@ class Window(QtGui.QDialog):
         #self.dirname = askdirectory()
         self.dirname += "/"
 
+        # Folder of packed clip stores (see ClipStore.py); a patient with a store there is
+        # loaded from it instead of from its .mat files
+        self.storedir = "E:/KaggleData/store/"
+
         self.patient = "Dog_1"
         self.typ = "ictal"
         self.rang = "500"
@@ -34,6 +93,7 @@ class Window(QtGui.QDialog):
         self.end = "60"
 
         self.data = None
+        self.pyramids = {}      # channel -> envelope_pyramid() of the loaded data
 
         self.graph = plt.figure()
         self.canvas = FigureCanvas(self.graph)
@@ -148,23 +208,47 @@ class Window(QtGui.QDialog):
 
     def load(self):
         print("loading files...")
-        filestub = self.dirname + self.patient + "/" + self.patient + "_" + self.typ + "_segment_"
-        cont = 1
-        i = 2
-        print("file", i)
-        self.data = scipy.io.loadmat(filestub + "1.mat")['data']
+        self.pyramids = {}
+        if HasStore(self.storedir, self.patient):
+            self.load_store()
+            return
+        self.load_files()
+
+    def load_files(self):
+        # enumerate the segments up front from the clip index (headers only), then fill
+        # one preallocated channels x samples buffer in place
+        patientdir = os.path.join(self.dirname, self.patient)
+        entries = ClipIndex(patientdir).Entries(self.typ)
+        if not entries:
+            print("no", self.typ, "segments in", patientdir)
+            return
+        total = sum(entry['samples'] for fn, entry in entries)
+        self.data = None
+        offset = 0
+        lats = []
+        for fn, entry in entries:
+            print(os.path.join(patientdir, fn))
+            dat = scipy.io.loadmat(os.path.join(patientdir, fn), variable_names=['data'])['data']
+            if self.data is None:
+                self.data = np.empty((entry['channels'], total), dtype=dat.dtype)
+            self.data[:, offset:offset + dat.shape[1]] = dat
+            offset += dat.shape[1]
+            lats.append(-1 if not lats or entry['latency'] is None else int(entry['latency']))
+        self.set_lens(lats)
+        self.display()
+        print("load complete")
+
+    def load_store(self):
+        store = ClipStore(self.storedir, self.patient)
+        self.data = store.Concatenated(self.typ)
         lats = [-1]
-        while cont:
-            try:
-                f = scipy.io.loadmat(filestub + str(i) + ".mat")
-                dat = f['data']
-                lat = f['latency']
-                self.data = concatenate((self.data, dat), 1)
-                lats.append(int(lat[0]))
-                print(filestub + str(i) + ".mat")
-            except:
-                cont = 0
-            i += 1
+        for lat in store.Meta['latency'][store.Select(self.typ)][1:]:
+            lats.append(-1 if np.isnan(lat) else int(lat))
+        self.set_lens(lats)
+        self.display()
+        print("load complete")
+
+    def set_lens(self, lats):
         self.lens = []
         i = 0
         j = 0
@@ -178,36 +262,44 @@ class Window(QtGui.QDialog):
         if self.typ == 'interictal':
             self.lens = [len(self.data[0])/400]
         print(self.lens)
-        self.display()
-        print("load complete")
+
+    def pyramid(self, c):
+        # min/max envelopes of channel c, built the first time the channel is shown
+        if c not in self.pyramids:
+            self.pyramids[c] = envelope_pyramid(np.asarray(self.data[c]))
+        return(self.pyramids[c])
 
     def display(self):
-        if self.data != None:
+        if self.data is not None:
             print("generating display")
             axis = self.graph.add_subplot(1, 1, 1)
             axis.cla()
             axis.hold(True)
             length = len(self.data[int(self.channel) - 1])
-            if int(self.end) > length:
-                self.end = str(length / 400)
+            if int(self.end) * freq > length:
+                self.end = str(length // freq)
             s = int(self.start)
             e = int(self.end)
             c = int(self.channel) - 1
-            xrange = np.arange(s, e * 400, 1/400)
+
+            # draw the span at the envelope level matching the axis width in pixels, so
+            # the number of points drawn does not grow with the span
+            levels = self.pyramid(c)
+            level = envelope_level(levels, (e - s) * freq, axis.bbox.width)
             i = 0
             color = 0
             for j in range(0, len(self.lens)):
-                end = i + self.lens[j]
-                if end > e:
-                    end = e - s
-                tempx = xrange[i * 400:end * 400]
-                tempy = self.data[c][i * 400:end * 400]
-                axis.plot(tempx, tempy, colors[color])
+                first = max(i, s)
+                last = min(i + self.lens[j], e)
+                if last > first:
+                    tempx, tempy = envelope_points(levels, level, int(first * freq), int(last * freq))
+                    axis.plot(tempx, tempy, colors[color])
                 i += self.lens[j]
                 if color % 8 == 7:
                     color = 0
                 else:
                     color += 1
+            axis.set_xlim([s, e])
             axis.set_ylim([-1 * int(self.rang), int(self.rang)])
             self.canvas.draw()
             axis.hold(False)
@@ -0,0 +1,116 @@
+"""
+FeatureCache.py: Persistent on-disk cache of per-channel feature values.
+
+Each patient gets one sqlite file in the cache folder.  A cached value is keyed
+by the clip's absolute path, size and modification time, by the feature name
+and its registered version (see RegisterFeature() in FeatureEngine.py), and by
+the compute dtype it was computed in (see SetComputeDtype()), so editing a clip
+or bumping a feature's version makes the old value invisible, and float32 and
+float64 values are kept side by side rather than mixed.
+The clip's sampling frequency and latency are kept too, so a fully cached clip
+never has to be loaded.
+
+The cache is used through FeatureExplorer.LoadFeatures() by Trainer.py,
+Classifier.py and FExplorer.
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+
+from FeatureEngine import FeatureVersion
+from FeatureEngine import GetComputeDtype
+
+
+# Folder of the cache files, shared by Trainer.py, Classifier.py and FExplorer so the features
+# one of them computes are reused by the others
+CacheDir = "E:/feature cache/"
+
+
+#####################################################################################
+# Feature Cache Class
+#####################################################################################
+class FeatureCache():
+
+    #
+    # Class constructor, opens (or creates) the cache file at CachePath
+    #
+    def __init__(self, CachePath):
+        self.CachePath = CachePath
+        self.Connection = sqlite3.connect(CachePath, timeout=60)
+        self.Connection.execute('PRAGMA journal_mode=WAL')          #Lets pool workers read while another one writes
+        self.Connection.execute('CREATE TABLE IF NOT EXISTS clips (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, freq REAL, latency REAL)')
+        Columns = [Row[1] for Row in self.Connection.execute('PRAGMA table_info(features)')]
+        if Columns and 'dtype' not in Columns:
+            # Cache written before values were keyed by compute dtype; they are all float64
+            self.Connection.execute('ALTER TABLE features RENAME TO features_v1')
+        self.Connection.execute('CREATE TABLE IF NOT EXISTS features (path TEXT, feature TEXT, dtype TEXT, version INTEGER, data BLOB, PRIMARY KEY (path, feature, dtype))')
+        if Columns and 'dtype' not in Columns:
+            self.Connection.execute("INSERT INTO features SELECT path, feature, 'float64', version, data FROM features_v1")
+            self.Connection.execute('DROP TABLE features_v1')
+        self.Connection.commit()
+
+    #
+    # Lookup(): cached info of one clip.  Returns (Fsample, Latency, Values) where Values is a dict
+    # of per-channel ndarrays for those of FENames that are cached at their current version and
+    # in the current compute dtype, or None when the clip is not cached or has changed since it
+    # was cached
+    #
+    def Lookup(self, FullPath, FENames):
+        Path, Size, Mtime = ClipKey(FullPath)
+        Row = self.Connection.execute('SELECT size, mtime, freq, latency FROM clips WHERE path=?', (Path,)).fetchone()
+        if Row is None or Row[0] != Size or Row[1] != Mtime:
+            return(None)
+
+        Values = {}
+        Query = 'SELECT feature, version, data FROM features WHERE path=? AND dtype=?'
+        for FEName, Version, Data in self.Connection.execute(Query, (Path, DtypeName())):
+            if FEName in FENames and Version == FeatureVersion(FEName):
+                Values[FEName] = np.frombuffer(Data, dtype=np.float64)
+        return(Row[2], Row[3], Values)
+
+    #
+    # Store(): record the info and feature values of one clip, computed in the current compute
+    # dtype.  Values is a dict of per-channel values keyed by feature name.  Call Commit() to
+    # write the records to disk
+    #
+    def Store(self, FullPath, Fsample, Latency, Values):
+        Path, Size, Mtime = ClipKey(FullPath)
+        Row = self.Connection.execute('SELECT size, mtime FROM clips WHERE path=?', (Path,)).fetchone()
+        if Row is not None and (Row[0] != Size or Row[1] != Mtime):
+            self.Connection.execute('DELETE FROM features WHERE path=?', (Path,))   #Clip has changed, drop its stale values
+        self.Connection.execute('INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?)', (Path, Size, Mtime, Fsample, Latency))
+        for FEName in Values:
+            Data = np.ascontiguousarray(Values[FEName], dtype=np.float64).tobytes()
+            self.Connection.execute('INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?)', (Path, FEName, DtypeName(), FeatureVersion(FEName), Data))
+
+    def Commit(self):
+        self.Connection.commit()
+
+    def Close(self):
+        self.Connection.close()
+
+
+#
+# ClipKey()
+# Identity of a clip file: (absolute path, size, modification time)
+def ClipKey(FullPath):
+    Stat = os.stat(FullPath)
+    return(os.path.abspath(FullPath), Stat.st_size, Stat.st_mtime)
+
+
+#
+# DtypeName()
+# Name of the current compute dtype, part of the key of every cached value
+def DtypeName():
+    return(np.dtype(GetComputeDtype()).name)
+
+
+#
+# PatientCache()
+# Open the cache file of the patient whose clips are in PatientDir
+def PatientCache(PatientDir, Folder=CacheDir):
+    os.makedirs(Folder, exist_ok=True)
+    Patient = os.path.basename(os.path.normpath(PatientDir))
+    return(FeatureCache(os.path.join(Folder, Patient + '.sqlite')))
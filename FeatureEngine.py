@@ -0,0 +1,338 @@
+"""
+FeatureEngine.py: Vectorized feature extraction over batches of clips.
+
+A batch is a 3D ndarray shaped (clips, channels, samples), i.e. the 'data'
+arrays of several clips stacked along a new first axis (a single clip is a
+batch of one, DataArray[np.newaxis]).  Every feature is computed for all clips
+and channels with array-wide NumPy operations and comes back as a
+(clips, channels) ndarray.  The values match, to within floating point
+rounding, the per-channel loops that the extractors in FeatureExplorer.py
+originally ran.
+
+Features are looked up by their FSCombo display name in a registry (see
+RegisterFeature()), and BatchFeatures() runs any set of them on one batch,
+computing the intermediates they share only once.
+"""
+
+import numpy as np
+
+from FilterBank import GetFilterBank
+from FilterBank import FilterFiles
+
+
+#
+# bender()
+# Quick and dirty limiting function modeled after sigmoid function
+def bender(x,mean,span):
+    out = 1.0/(1.0+np.exp(-3.3*(x-mean)/span))
+    return(out)
+
+
+#
+# BPFEnergy()
+# log of the I/Q magnitude of the clip against a band-pass filter.  The filter
+# is as long as the clip, so the Q sum is a dot product of each channel with the
+# Q coefficients.  The I sum only takes the element of the product whose index
+# equals the channel number, which is what the original per-channel loop did
+# (Isum=np.sum(Iproduct[i])); it is kept so the trained results stay comparable.
+# Clips not sampled at the filter bank's NativeFreq get a filter designed for
+# their own sampling frequency and length; their energies are not comparable with
+# those at NativeFreq (see FilterBank.py).
+def BPFEnergy(DataBatch, Fsample, Band):
+    FilterCoefI, FilterCoefQ = GetFilterBank().GetFilter(Band, Fsample, DataBatch.shape[-1])
+    FilterCoefI = FilterCoefI.astype(DataBatch.dtype)
+    FilterCoefQ = FilterCoefQ.astype(DataBatch.dtype)
+    Channels = np.arange(DataBatch.shape[1])
+
+    Isum = FilterCoefI[Channels]*DataBatch[:, Channels, Channels]
+    Qsum = np.einsum('kcs,s->kc', DataBatch, FilterCoefQ)
+
+    return(np.log(np.sqrt(Isum*Isum + Qsum*Qsum)))
+
+
+#
+# FilterTail()
+# The last TailSamples samples of every channel of every clip filtered with the complex
+# (I + jQ) coefficients of a band (the full convolution), as a (clips, channels, TailSamples)
+# array.  The real part is the I path and the imaginary part the Q path.  They are the only
+# filtered samples the line length features read, and each is a sum of a few products of
+# the clips' last samples with the filter's last coefficients, so they are computed
+# directly rather than filtering the whole clip.  The filter is designed for Fsample when
+# that is not the filter bank's NativeFreq, and the sums run in the batch's own precision.
+def FilterTail(DataBatch, Fsample, Band):
+    Coef = GetFilterBank().GetCoef(Band, Fsample)
+    Coef = Coef.astype(np.result_type(DataBatch.dtype, np.complex64), copy=False)
+
+    Tail = min(TailSamples, DataBatch.shape[-1], len(Coef))
+    Filtered = np.zeros(DataBatch.shape[:-1] + (Tail,), dtype=Coef.dtype)
+    for i in range(Tail):
+        for j in range(Tail - i):
+            Filtered[..., Tail - 1 - i - j] += DataBatch[..., -1 - i]*Coef[-1 - j]
+    return(Filtered)
+
+
+# Samples at the end of the filtered clips that FilterTail() computes
+TailSamples = 2
+
+
+#
+# LineLength()
+# I plus Q line length of the last step of a band-filtered batch (see FilterTail()), from
+# np.diff of its last samples.  The original per-channel loop overwrote its line length on
+# every step instead of adding to it, so the features (and the bender() means tuned on
+# them) use the length of the last filter step only.
+def LineLength(Filtered):
+    Steps = np.diff(Filtered, axis=-1)
+    return(np.abs(Steps.real[..., -1]) + np.abs(Steps.imag[..., -1]))
+
+
+#####################################################################################
+# Feature Registry
+# Features declare the intermediates they are computed from.  'data' (the batch)
+# and 'freq' (the sampling frequency) are always available; every other
+# intermediate is registered with its own inputs, so asking for several features
+# builds a dependency graph in which each intermediate is computed once per batch.
+#
+# A new feature only needs a RegisterFeature() decorator here to show up in
+# FeatureExplorer's FSCombo and to be usable from ExtractFeature()/BatchFeatures().
+#####################################################################################
+
+# Floating point type the batches and intermediates are computed in.  float64 by
+# default; float32 halves the memory traffic and lets bigger batches fit in cache
+# and RAM, at a small cost in precision (see SetComputeDtype(), CheckComputeDtype())
+ComputeDtype = np.float64
+
+Intermediates = {}          #Intermediate name -> (function, input names, extra args)
+Features = {}               #Feature name -> FeatureSpec, in registration (display) order
+
+# Features used by the kNN model in Trainer.py and Classifier.py
+ModelFeatures = ('Peak Detect', 'Difference Channel Peak Deviation', '10-20Hz BPF')
+
+
+#
+# FeatureSpec
+# Registry entry of one feature.  Summary says how the per-channel values are
+# reduced to one value per clip: 'mean' over channels, or 'first' for features
+# that repeat one value on every channel.  Version must be bumped whenever the
+# feature's output changes, so values stored by FeatureCache.py are recomputed
+class FeatureSpec():
+    def __init__(self, Name, Function, Inputs, Summary, Version):
+        self.Name = Name
+        self.Function = Function
+        self.Inputs = tuple(Inputs)
+        self.Summary = Summary
+        self.Version = Version
+
+
+#
+# AddIntermediate()
+# Register an intermediate computed as Function(*inputs, *Args)
+def AddIntermediate(Name, Function, Inputs, Args=()):
+    Intermediates[Name] = (Function, tuple(Inputs), tuple(Args))
+
+
+#
+# RegisterIntermediate(), RegisterFeature()
+# Decorators that add the decorated function to the registry
+def RegisterIntermediate(Name, Inputs):
+    def Register(Function):
+        AddIntermediate(Name, Function, Inputs)
+        return(Function)
+    return(Register)
+
+def RegisterFeature(Name, Inputs, Summary='mean', Version=1):
+    def Register(Function):
+        Features[Name] = FeatureSpec(Name, Function, Inputs, Summary, Version)
+        return(Function)
+    return(Register)
+
+
+#
+# FeatureNames()
+# Names of all registered features, in display order
+def FeatureNames():
+    return(tuple(Features.keys()))
+
+
+#
+# SetComputeDtype()
+# Select the floating point type used by BatchFeatures() when none is passed
+def SetComputeDtype(Dtype):
+    global ComputeDtype
+    Dtype = np.dtype(Dtype)
+    if Dtype not in (np.float32, np.float64):
+        raise ValueError('Compute dtype must be float32 or float64, not %s' % Dtype)
+    ComputeDtype = Dtype.type
+
+
+#
+# GetComputeDtype()
+# The floating point type used by BatchFeatures() when none is passed (see SetComputeDtype())
+def GetComputeDtype():
+    return(ComputeDtype)
+
+
+#
+# FeatureVersion()
+# Version tag of a registered feature
+def FeatureVersion(FEName):
+    return(Features[FEName].Version)
+
+
+#
+# Schedule()
+# Order in which the intermediates needed by FENames must be computed.  Every
+# intermediate appears once and after all of its inputs
+def Schedule(FENames):
+    Order = []
+    Visited = set(['data', 'freq'])
+
+    def Visit(Name):
+        if Name in Visited:
+            return
+        Visited.add(Name)
+        for Input in Intermediates[Name][1]:
+            Visit(Input)
+        Order.append(Name)
+
+    for FEName in FENames:
+        for Input in Features[FEName].Inputs:
+            Visit(Input)
+    return(Order)
+
+
+#
+# BatchFeatures()
+# Run several features on one (clips, channels, samples) batch.  Returns a dict
+# keyed by feature name; each value is a (clips, channels) ndarray.  The batch and
+# every intermediate are kept in Dtype, ComputeDtype by default
+def BatchFeatures(FENames, DataBatch, Fsample, Dtype=None):
+    if Dtype is None:
+        Dtype = ComputeDtype
+    ValidNames = []
+    for FEName in FENames:
+        if FEName not in Features:
+            print('No valid feature selected!')
+        else:
+            ValidNames.append(FEName)
+
+    Values = {'data': np.asarray(DataBatch, dtype=Dtype), 'freq': Fsample}
+    for Name in Schedule(ValidNames):
+        Function, Inputs, Args = Intermediates[Name]
+        Values[Name] = Function(*[Values[Input] for Input in Inputs], *Args)
+
+    Output = {}
+    for FEName in ValidNames:
+        Spec = Features[FEName]
+        Output[FEName] = Spec.Function(*[Values[Input] for Input in Spec.Inputs])
+    return(Output)
+
+
+#
+# CheckComputeDtype()
+# Compare the features computed in Dtype with the float64 results on a sample batch.
+# Returns (Passed, Deviations): whether every feature is within Tolerance (absolute, the
+# features are limited to 0..1 by bender()) and the largest deviation of each feature
+def CheckComputeDtype(FENames, DataBatch, Fsample, Dtype=np.float32, Tolerance=1e-3):
+    Reference = BatchFeatures(FENames, DataBatch, Fsample, np.float64)
+    Candidate = BatchFeatures(FENames, DataBatch, Fsample, Dtype)
+
+    Deviations = {}
+    for FEName in Reference:
+        Deviation = np.abs(Candidate[FEName] - Reference[FEName])
+        Deviation[np.isnan(Candidate[FEName]) & np.isnan(Reference[FEName])] = 0.0
+        Deviations[FEName] = float(np.max(Deviation)) if Deviation.size else 0.0
+    Passed = all(Deviations[FEName] <= Tolerance for FEName in Deviations)
+    return(Passed, Deviations)
+
+
+#
+# SummarizeFeatures()
+# Reduce the per-channel output of BatchFeatures() to a (clips, features) matrix
+# using each feature's Summary, with columns in FENames order
+def SummarizeFeatures(Output, FENames):
+    Columns = []
+    for FEName in FENames:
+        if Features[FEName].Summary == 'first':
+            Columns.append(Output[FEName][:, 0])
+        else:
+            Columns.append(np.mean(Output[FEName], axis=1))
+    return(np.stack(Columns, axis=1))
+
+
+#####################################################################################
+# Intermediates
+#####################################################################################
+
+@RegisterIntermediate('diff', ('data',))
+def Difference(DataBatch):
+    return(np.diff(DataBatch, axis=-1))
+
+@RegisterIntermediate('peaks', ('data',))
+def Peaks(DataBatch):
+    return(DataBatch.max(axis=-1))
+
+@RegisterIntermediate('diff peaks', ('diff',))
+def DifferencePeaks(DifferenceBatch):
+    return(DifferenceBatch.max(axis=-1))
+
+# Band energies and the ends of the band-filtered signals, for every band in the filter bank
+for Band in FilterFiles:
+    AddIntermediate('bpf ' + Band, BPFEnergy, ('data', 'freq'), (Band,))
+    AddIntermediate('filter tail ' + Band, FilterTail, ('data', 'freq'), (Band,))
+    AddIntermediate('diff filter tail ' + Band, FilterTail, ('diff', 'freq'), (Band,))
+
+
+#####################################################################################
+# Batch Feature Extractors
+# Each function is passed its declared inputs and returns a (clips, channels)
+# ndarray of feature values.  The second and third args of bender() are the mean
+# and span of each feature.
+#####################################################################################
+
+@RegisterFeature('Peak Detect', ('peaks',))
+def BatchPeakDetect(Peaks):
+    return(bender(np.log10(Peaks*Peaks), 4.8, 3.0))
+
+@RegisterFeature('10-20Hz BPF', ('bpf TenTwentyBPF',))
+def BatchTenTwentyBPF(Energy):
+    return(bender(Energy, 3.0, 8.0))
+
+@RegisterFeature('10-20Hz Upslope', ('bpf TenTwentyUpslopeBPF',))
+def BatchTenTwentyUpslopeBPF(Energy):
+    return(bender(Energy, 3.0, 6.0))
+
+@RegisterFeature('10-20Hz Downslope', ('bpf TenTwentyDownslopeBPF',))
+def BatchTenTwentyDownslopeBPF(Energy):
+    return(bender(Energy, 4.0, 4.0))
+
+@RegisterFeature('10-30Hz Line Length', ('filter tail TenThirtyBPF',))
+def BatchTenThirtyBPFLL(Filtered):
+    return(bender(np.log10(LineLength(Filtered)), -3.5, 3.0))
+
+@RegisterFeature('20-30Hz Line Length', ('filter tail TwentyThirtyBPF',))
+def BatchTwentyThirtyBPFLL(Filtered):
+    return(bender(np.log10(LineLength(Filtered)), -2.7, 3.0))
+
+@RegisterFeature('Difference Peak', ('diff peaks',))
+def BatchdifPeakDetect(Peaks):
+    return(bender(np.log10(Peaks*Peaks), 4, 4.5))
+
+@RegisterFeature('Difference 10-20Hz Line Length', ('diff filter tail TenTwentyBPF',))
+def BatchdifTenTwentyBPFLL(Filtered):
+    return(bender(np.log10(LineLength(Filtered)), -2.7, 3.0))
+
+#
+# BatchChannelPeakDeviation(), BatchdifChannelPeakDeviation()
+# Standard deviation of the channel peak values, repeated for every channel
+@RegisterFeature('Channel Peak Deviation', ('peaks',), Summary='first')
+def BatchChannelPeakDeviation(Peaks):
+    Levels = bender(np.log10(Peaks*Peaks), 4.8, 3.0)
+    Deviation = np.std(Levels, axis=1, keepdims=True)
+    return(np.repeat(Deviation, Levels.shape[1], axis=1))
+
+@RegisterFeature('Difference Channel Peak Deviation', ('diff peaks',), Summary='first')
+def BatchdifChannelPeakDeviation(Peaks):
+    Levels = bender(np.log10(Peaks*Peaks), 4.8, 3)
+    Deviation = bender(np.std(Levels, axis=1, keepdims=True), .055, .1)
+    return(np.repeat(Deviation, Levels.shape[1], axis=1))
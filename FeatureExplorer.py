@@ -16,6 +16,7 @@ Channel identification information is stored in a <patientID>.mat file.
 
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 import tkinter as tk
 from tkinter import *
@@ -25,6 +26,14 @@ from tkinter.filedialog import askdirectory
 import numpy as np
 import scipy.io as spio
 import matplotlib.pyplot as plt
+
+from FeatureEngine import *
+from FilterBank import NativeFreq
+from FeatureCache import CacheDir
+from FeatureCache import PatientCache
+from ClipIndex import ClipIndex
+from ClipIndex import EarlyLatency
+from ClipLoader import PrefetchLoader
  
     
 #####################################################################################
@@ -46,12 +55,19 @@ class FExplorer(tk.Tk):
     def InitUI(self):
         # Initialize some shared variables
         self.DirPath = ''                               #Contains path to the folder that stores all the input files
+        self.Index = None                               #ClipIndex of the selected folder
+        self.ClipInfo = {}                              #Full path -> class ('interictal', 'early' or 'late', see ClipIndex.ClipClass()) of the clips being featurized
         
         self.SelectedFeature = tk.StringVar()           #Contains name of selected feature
 
         self.EarlyIctalFeatures=[]                      #List containing feature outputs from early ictal files. Rows correspond to input files, columns to channels
         self.LateIctalFeatures=[]                       #List containing feature outputs from late ictal files. Rows correspond to input files, columns to channels
         self.InterictalFeatures=[]                      #List containing feature outputs from interictal files. Rows correspond to input files, columns to channels  
+
+        self.Executor = None                            #Process pool running CalcFeatures(), None when idle
+        self.Futures = []                               #Chunks submitted to the process pool that have not been collected yet
+        self.ChunkSize = 32                             #Number of files featurized per pool task
+        self.PollInterval = 100                         #Milliseconds between checks for finished chunks
         
         # Configure the main window and frame
         self.title('Feature Explorer')
@@ -67,12 +83,16 @@ class FExplorer(tk.Tk):
         self.SFLabel.grid(row=0, column=1, sticky=W)
 
         self.FSCombo = tk.ttk.Combobox(self.mainframe, textvariable=self.SelectedFeature)
-        self.FSCombo['values'] = ('Peak Detect', '10-20Hz BPF', '10-20Hz Upslope', '10-20Hz Downslope', '10-30Hz Line Length', '20-30Hz Line Length', 'Difference Peak', 'Difference 10-20Hz Line Length', 'Channel Peak Deviation', 'Difference Channel Peak Deviation')
+        self.FSCombo['values'] = FeatureNames()
         self.FSCombo.current(0)
         self.FSCombo.grid(row=1, column=0, sticky=W)
                
         self.CFButton = tk.ttk.Button(self.mainframe, text="Calc Features...", command=self.CalcFeatures)
         self.CFButton.grid(row=2, column=0, sticky=W)
+        self.CancelButton = tk.ttk.Button(self.mainframe, text="Cancel", command=self.CancelFeatures, state='disabled')
+        self.CancelButton.grid(row=2, column=1, sticky=W)
+        self.Progress = tk.ttk.Progressbar(self.mainframe, orient='horizontal', mode='determinate')
+        self.Progress.grid(row=4, column=0, columnspan=2, sticky=(W,E))
           
         self.PRButton = tk.ttk.Button(self.mainframe, text="Plot Results...", command=self.PlotResults)
         self.PRButton.grid(row=3, column=0, sticky=W)  
@@ -102,62 +122,107 @@ class FExplorer(tk.Tk):
             self.SFLabel['text']='Folder: ', self.DirPath
      
 
-            # Open the first ictal file then retreive some basic info about the files
-            reIctal=re.compile('_ictal_segment_1.mat+')
-            for FileName in os.listdir(self.DirPath):
-                if reIctal.search(FileName):
-                    FullPath = os.path.join(self.DirPath, FileName)
-                    
-                    TempClipData = spio.loadmat(FullPath)     
-                    TempDataArray = TempClipData['data']
-                    TempDataArray = TempDataArray.transpose()
-                    self.LastChan = int(TempDataArray.shape[1])     #Last channel number
-                    self.Channels = np.arange(0, self.LastChan,1)   #List of channels                 
+            # Retreive some basic info about the files from the folder's clip index (no clip is loaded)
+            self.Index = ClipIndex(self.DirPath)
+            self.LastChan = int(self.Index.Channels())      #Last channel number
+            self.Channels = np.arange(0, self.LastChan,1)   #List of channels                 
     #
     # CalcFeatures(): Calculate features for all files in selected folder. 
     # Process the early ictal, late ictal, and interictal files separately so that the results can be grouped for histogram plotting
+    # The files are split into chunks that are featurized on a process pool; the results are collected by
+    # PollFeatures() as they arrive so the window stays responsive
     #
     def CalcFeatures(self):
             print('Entering CalcFeatures()')
 
-            # Compile search expressions for finding files
-            reIctal=re.compile('_ictal+')
-            reInterIctal=re.compile('_interictal+')
-
             # Initialize lists used to hold histogram data. Columns correspond to channels, rows correspond to input data files
             self.EarlyIctalFeatures=[]
             self.LateIctalFeatures=[]
             self.InterictalFeatures=[]
 
-            # Iterate through interictal files
-            for FileName in os.listdir(self.DirPath):
-                if reInterIctal.search(FileName):
-                    FullPath = os.path.join(self.DirPath, FileName)
-                    #print('Processing interictal file: ', FileName)
-                    print('I', end="", flush=True)
-                    FeatureVector=ExtractFeature(self.FSCombo.get(), FullPath)
-                    self.InterictalFeatures.append(FeatureVector)
-            
-            # Iterate through ictal files, handle the early ictal and late ictal separately
-            for FileName in os.listdir(self.DirPath):
-                if reIctal.search(FileName):
+            FEName = self.FSCombo.get()
+
+            # Collect the interictal and ictal files, with their class, from the clip index
+            self.Index.Refresh()
+            FullPaths = []
+            self.ClipInfo = {}
+            for FileName, Entry in self.Index.Entries():
+                if Entry['type'] in ('interictal', 'ictal'):
                     FullPath = os.path.join(self.DirPath, FileName)
-                    TempClipData = spio.loadmat(FullPath)
-                    Latency = float(TempClipData['latency'])    #Latency of ictal segment (time from sz start)
-                    #print('Processing ictal file: ', FileName, 'Latency is: ', Latency)
-                    if Latency<=16.0:
-                        #print('Found an early ictal file...')
-                        print('E', end="", flush=True)
-                        FeatureVector=ExtractFeature(self.FSCombo.get(), FullPath)
+                    FullPaths.append(FullPath)
+                    self.ClipInfo[FullPath] = Entry['class']
+
+            # Submit the files to the process pool in chunks
+            self.Executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+            self.Futures = []
+            for First in range(0, len(FullPaths), self.ChunkSize):
+                Chunk = FullPaths[First:First + self.ChunkSize]
+                self.Futures.append(self.Executor.submit(CalcChunk, FEName, Chunk))
+
+            self.Progress['maximum'] = max(len(FullPaths), 1)
+            self.Progress['value'] = 0
+            self.CFButton['state'] = 'disabled'
+            self.CancelButton['state'] = 'normal'
+            self.after(self.PollInterval, self.PollFeatures)
+
+    #
+    # PollFeatures(): Move the results of finished chunks into the feature lists and update the progress bar.
+    # Reschedules itself until every chunk is done or the run is cancelled.  A chunk that failed (e.g. on a
+    # corrupt clip file) is reported and stops the run
+    #
+    def PollFeatures(self):
+            if self.Executor is None:
+                return
+
+            Pending = []
+            for Future in self.Futures:
+                if not Future.done():
+                    Pending.append(Future)
+                    continue
+                if Future.cancelled():
+                    continue
+                try:
+                    Results = Future.result()
+                except Exception as Error:
+                    print('Feature extraction failed:', repr(Error))
+                    self.CancelFeatures()
+                    return
+                for FullPath, FeatureVector in Results:
+                    Class = self.ClipInfo[FullPath]
+                    if Class == 'interictal':
+                        self.InterictalFeatures.append(FeatureVector)
+                    elif Class == 'early':                #Latency of ictal segment (time from sz start) below EarlyLatency
                         self.EarlyIctalFeatures.append(FeatureVector)
                     else:
-                        #print('Processing a later ictal file...')
-                        print('L', end="", flush=True)
-                        FeatureVector=ExtractFeature(self.FSCombo.get(), FullPath)
                         self.LateIctalFeatures.append(FeatureVector)
+                    self.Progress['value'] += 1
+            self.Futures = Pending
+
+            if self.Futures:
+                self.after(self.PollInterval, self.PollFeatures)
+            else:
+                self.StopFeatures()
+                print('Feature extraction complete: ', len(self.InterictalFeatures), 'interictal, ', len(self.EarlyIctalFeatures), 'early ictal, ', len(self.LateIctalFeatures), 'late ictal')
+
+    #
+    # CancelFeatures(): Drop the chunks that have not started yet; the lists keep the results already collected
+    #
+    def CancelFeatures(self):
+            print('Cancelling feature extraction')
+            for Future in self.Futures:
+                Future.cancel()
+            self.Futures = []
+            self.StopFeatures()
 
-            print(' ')
-            print('Feature extraction complete')
+    #
+    # StopFeatures(): Shut down the process pool and restore the buttons
+    #
+    def StopFeatures(self):
+            if self.Executor is not None:
+                self.Executor.shutdown(wait=False)
+                self.Executor = None
+            self.CFButton['state'] = 'normal'
+            self.CancelButton['state'] = 'disabled'
 
 
 
@@ -188,438 +253,266 @@ class FExplorer(tk.Tk):
 
 #####################################################################################
 # Feature Extractors
-# These functions are passed a string containing the path to an input clip file.
-# The function will then calculate feature values for each channel.  The values
-# are returned as a list variable.
+# The *Clip() functions are passed the data array, sampling frequency and latency of
+# a clip that has already been loaded.  The function will then calculate feature
+# values for each channel.  The values are returned as a list variable.
+# The path-based functions (PeakDetect(), TenTwentyBPF(), ...) load the clip file
+# and pass it on, so callers that need several features should use LoadClip() and
+# ExtractFeatures() to read each file only once.
 #####################################################################################
 
 #
 # ExtractFeature()
-# Call the correct feature extractor and return its results
+# Load a clip and return the per-channel values of one registered feature
 def ExtractFeature(FEName, FullPath):
-    if FEName == 'Peak Detect':
-        return(PeakDetect(FullPath))
-    elif FEName == '10-20Hz BPF':
-        return(TenTwentyBPF(FullPath))
-    elif FEName == '10-20Hz Upslope':
-        return(TenTwentyUpslopeBPF(FullPath))
-    elif FEName == '10-20Hz Downslope':
-        return(TenTwentyDownslopeBPF(FullPath))
-    elif FEName == '10-30Hz Line Length':
-        return(TenThirtyBPFLL(FullPath))
-    elif FEName == '20-30Hz Line Length':
-        return(TwentyThirtyBPFLL(FullPath))
-    elif FEName == 'Difference Peak':
-        return(difPeakDetect(FullPath))
-    elif FEName == 'Difference 10-20Hz Line Length':
-        return(difTenTwentyBPFLL(FullPath))
-    elif FEName == 'Channel Peak Deviation':
-        return(ChannelPeakDeviation(FullPath))
-    elif FEName == 'Difference Channel Peak Deviation':
-        return(difChannelPeakDeviation(FullPath))
-    else:
-        print('No valid feature selected!')
+    return(ExtractFeatures([FEName], *LoadClip(FullPath)).get(FEName))
 
 
 #
-# bender()
-# Quick and dirty limiting function modeled after sigmoid function
-def bender(x,mean,span):
-    out = 1.0/(1.0+np.exp(-3.3*(x-mean)/span))
-    return(out)
-
-
-#
-# PeakDetect()
-# This feature detector does a peak detect
-def PeakDetect(FullPath):
-    #print('Entering PeakDetect()')
+# LoadClip()
+# Read a clip file and return its data array, sampling frequency and latency.
+# Latency is None for clips that do not carry one (interictal and test clips)
+def LoadClip(FullPath):
     TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output
-
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        #FeatureOutput[i]=TempDataArray[:,i].max()
-        FeatureOutput[i]=np.log10(TempDataArray[:,i].max()*TempDataArray[:,i].max())
-        FeatureOutput[i] = bender(FeatureOutput[i], 4.8, 3.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span 
-        
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
-
-    early = 0
+    DataArray = TempClipData['data']
+    Fsample = float(TempClipData['freq'])
+    Latency = None
     if 'latency' in TempClipData.keys():
-        if TempClipData['latency'] < 16:
-            early = 1
-    
-    #Return feature vector in form of a list
-    return(FeatureList, early)
+        Latency = float(TempClipData['latency'])
+    return(DataArray, Fsample, Latency)
 
 
 #
-# TenTwentyBPF()
-# This feature detects energy in the 10-20Hz band
-def TenTwentyBPF(FullPath):
-    #print('Entering TenTwentyBPF()')
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output 
-
-    # Read in the digital filter coeficients and place in ndarrays
-    FilterInfo=spio.loadmat('FilterSetTenTwentyBPF.mat')
-
-    FilterCoefI = FilterInfo['FilterCoefI'].flatten()
-    FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
-
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        Iproduct = FilterCoefI*TempDataArray[:,i]
-        Isum=np.sum(Iproduct[i])
-        
-        Qproduct = FilterCoefQ*TempDataArray[:,i]
-        Qsum=np.sum(Qproduct)
-        
-        FeatureOutput[i] = np.log( np.sqrt(Isum*Isum + Qsum*Qsum) )
-        FeatureOutput[i] = bender(FeatureOutput[i], 3.0, 8.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span      
-
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
-
-    #Return feature vector in form of a list
-    return(FeatureList)
+# ExtractFeatures()
+# Run several feature extractors on one loaded clip, sharing the intermediates
+# they have in common.  Returns a dict keyed by feature name; each value is the
+# list of per-channel feature values
+def ExtractFeatures(FENames, DataArray, Fsample, Latency=None):
+    DataBatch = np.asarray(DataArray)[np.newaxis]
+    Output = BatchFeatures(FENames, DataBatch, float(Fsample))
+    Features = {}
+    for FEName in Output:
+        Features[FEName] = Output[FEName][0].tolist()   #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
+    return(Features)
 
 
 #
-# TenTwentyUpslopeBPF()
-# This feature detects energy in the 10-20Hz band, filter slopes-up with frequency
-def TenTwentyUpslopeBPF(FullPath):
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output 
-
-    # Read in the digital filter coeficients and place in ndarrays
-    FilterInfo=spio.loadmat('FilterSetTenTwentyUpslopeBPF.mat')
-
-    FilterCoefI = FilterInfo['FilterCoefI'].flatten()
-    FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
-
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        Iproduct = FilterCoefI*TempDataArray[:,i]
-        Isum=np.sum(Iproduct[i])
-        
-        Qproduct = FilterCoefQ*TempDataArray[:,i]
-        Qsum=np.sum(Qproduct)
-        
-        FeatureOutput[i] = np.log( np.sqrt(Isum*Isum + Qsum*Qsum) )
-        FeatureOutput[i] = bender(FeatureOutput[i], 3.0, 6.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span      
-
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
-
-    #Return feature vector in form of a list
-    return(FeatureList)
+# LoadFeatures()
+# Feature values and latencies of a list of clip files.  With a FeatureCache, clips whose
+# requested features are all cached at their current version are not loaded at all; the
+# others are loaded once, featurized as one batch and recorded in the cache.  With a
+# ClipStore, clips packed in the store are read from its memory map instead of their file.
+# Clip files are read with Load (LoadClip, or the Get() of a PrefetchLoader).  Lookups holds
+# the results of Cache.Lookup() already made for some of the clips, by full path, so they are
+# not looked up again.  Returns (Features, Latencies): a dict of (clips, channels) ndarrays
+# keyed by feature name, and a list with the latency of each clip
+def LoadFeatures(FENames, FullPaths, Cache=None, Store=None, Load=LoadClip, Lookups=None):
+    FENames = [FEName for FEName in FENames if FEName in FeatureNames()]
+    Rows = [None]*len(FullPaths)
+    Latencies = [None]*len(FullPaths)
+
+    Missing = []
+    for k, FullPath in enumerate(FullPaths):
+        if Cache is not None:
+            if Lookups is not None and FullPath in Lookups:
+                Cached = Lookups[FullPath]
+            else:
+                Cached = Cache.Lookup(FullPath, FENames)
+            if Cached is not None and len(Cached[2]) == len(FENames):
+                Rows[k] = Cached[2]
+                Latencies[k] = Cached[1]
+                continue
+        Missing.append(k)
+
+    if Missing:
+        Clips = []
+        for k in Missing:
+            Row = None if Store is None else Store.Find(FullPaths[k])
+            if Row is None:
+                Clips.append(Load(FullPaths[k]))
+            else:
+                Clips.append(Store.Clip(Row))
+        Output = BatchFeatures(FENames, np.stack([Clip[0] for Clip in Clips]), Clips[0][1])
+        for j, k in enumerate(Missing):
+            Rows[k] = dict((FEName, Output[FEName][j]) for FEName in FENames)
+            Latencies[k] = Clips[j][2]
+            if Cache is not None:
+                Cache.Store(FullPaths[k], Clips[j][1], Clips[j][2], Rows[k])
+        if Cache is not None:
+            Cache.Commit()
+
+    Features = {}
+    for FEName in FENames:
+        Features[FEName] = np.array([Row[FEName] for Row in Rows])
+    return(Features, Latencies)
 
 
 #
-# TenTwentyDownslopeBPF()
-# This feature detects energy in the 10-20Hz band, filter slopes-down with frequency
-def TenTwentyDownslopeBPF(FullPath):
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output 
-
-    # Read in the digital filter coeficients and place in ndarrays
-    FilterInfo=spio.loadmat('FilterSetTenTwentyDownslopeBPF.mat')
-
-    FilterCoefI = FilterInfo['FilterCoefI'].flatten()
-    FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
-
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        Iproduct = FilterCoefI*TempDataArray[:,i]
-        Isum=np.sum(Iproduct[i])
-        
-        Qproduct = FilterCoefQ*TempDataArray[:,i]
-        Qsum=np.sum(Qproduct)
-        
-        FeatureOutput[i] = np.log( np.sqrt(Isum*Isum + Qsum*Qsum) )
-        FeatureOutput[i] = bender(FeatureOutput[i], 4.0, 4.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span      
-
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
-
-    #Return feature vector in form of a list
-    return(FeatureList)
+# FeatureBatches()
+# LoadFeatures() over a long list of clip files, BatchSize clips at a time.  The clip files
+# that will have to be read (those not fully cached and not in the store) are read ahead on
+# a PrefetchLoader with Workers threads, at most MaxInFlight clips ahead (default BatchSize),
+# while the current batch is featurized, with Load (a LoadClip() stand-in, such as
+# Resampler.LoadResampledClip() to resample them as they are read).  Every clip is looked up
+# in the cache once, up front, and the results are handed to LoadFeatures() batch by batch.
+# Yields (FullPaths, Features, Latencies) per batch, in order
+def FeatureBatches(FENames, FullPaths, BatchSize, Cache=None, Store=None, Workers=4, MaxInFlight=None, Load=LoadClip):
+    FENames = [FEName for FEName in FENames if FEName in FeatureNames()]
+    if MaxInFlight is None:
+        MaxInFlight = BatchSize
+
+    ToRead = []
+    Lookups = {}                                        #Cache.Lookup() of every clip, handed on to LoadFeatures()
+    for FullPath in FullPaths:
+        if Cache is not None:
+            Cached = Cache.Lookup(FullPath, FENames)
+            Lookups[FullPath] = Cached
+            if Cached is not None and len(Cached[2]) == len(FENames):
+                continue
+        if Store is not None and Store.Find(FullPath) is not None:
+            continue
+        ToRead.append(FullPath)
+
+    with PrefetchLoader(ToRead, Load, Workers, MaxInFlight) as Loader:
+        for First in range(0, len(FullPaths), BatchSize):
+            Batch = FullPaths[First:First + BatchSize]
+            BatchLookups = dict((FullPath, Lookups.pop(FullPath)) for FullPath in Batch if FullPath in Lookups)
+            Features, Latencies = LoadFeatures(FENames, Batch, Cache, Store, Loader.Get, BatchLookups)
+            yield(Batch, Features, Latencies)
 
 
 #
-# TenThirtyBPFLL()
-# This feature filters in the 10-30Hz band then computes line length. Filter is 100 pts long.
-def TenThirtyBPFLL(FullPath):
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output 
-
-    # Read in the digital filter coeficients and place in ndarrays
-    FilterInfo=spio.loadmat('FilterSetTenThirtyBPF.mat')
+# CheckClipDtype()
+# CheckComputeDtype() on a sample batch of the clip files FullPaths: up to Clips of them with the
+# shape of the first, read with Load.  Raises ValueError when a feature computed in Dtype strays
+# from float64 by more than Tolerance; returns the largest deviation of each feature
+def CheckClipDtype(FENames, FullPaths, Dtype, Load=LoadClip, Clips=8, Tolerance=1e-3):
+    Sample = [Load(FullPath) for FullPath in FullPaths[:Clips]]
+    Batch = np.stack([Clip[0] for Clip in Sample if Clip[0].shape == Sample[0][0].shape])
+    Passed, Deviations = CheckComputeDtype(FENames, Batch, Sample[0][1], Dtype, Tolerance)
+    if not Passed:
+        raise ValueError('Features computed in %s stray from float64 on %s: %s'
+                         % (np.dtype(Dtype).name, os.path.dirname(FullPaths[0]), Deviations))
+    return(Deviations)
 
-    FilterCoefI = FilterInfo['FilterCoefI'].flatten()
-    FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
-    
-    ILineLength=0.0
-    QLineLength=0.0
 
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        Ifilt = np.convolve(FilterCoefI, TempDataArray[:,i])     
-        Qfilt = np.convolve(FilterCoefQ, TempDataArray[:,i])
-        
-        
-        for j in range (1, Ifilt.size):
-            ILineLength = np.abs(Ifilt[j]-Ifilt[j-1])
-            QLineLength = np.abs(Qfilt[j]-Qfilt[j-1])
-        
-        FeatureOutput[i] = np.log10(ILineLength+QLineLength)
-        FeatureOutput[i] = bender(FeatureOutput[i], -3.5, 3.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span      
+#
+# CheckClipFreq()
+# Raise ValueError unless the clip file FullPath, read with Load, comes out sampled at the
+# filter bank's NativeFreq.  The features and their bender() constants were tuned on clips at
+# that rate, and values computed at other rates are not comparable (see FilterBank.py), so a
+# model must not be trained or queried with them.  Returns the sampling frequency
+def CheckClipFreq(FullPath, Load=LoadClip):
+    Fsample = Load(FullPath)[1]
+    if Fsample != NativeFreq:
+        raise ValueError('%s would be featurized at %g Hz, the features are tuned for %g Hz: resample the clips to it (resamplefreq)'
+                         % (FullPath, Fsample, NativeFreq))
+    return(Fsample)
 
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
 
-    #Return feature vector in form of a list
-    return(FeatureList)
+#
+# CalcChunk()
+# Process pool task used by FExplorer.CalcFeatures(): featurize a chunk of clips, going through
+# the patient's feature cache, and return (FullPath, FeatureVector) for every clip.  The chunk
+# is featurized BatchSize clips at a time so reading the next clips overlaps the computation
+def CalcChunk(FEName, FullPaths, CacheFolder=CacheDir, BatchSize=8):
+    Cache = PatientCache(os.path.dirname(FullPaths[0]), CacheFolder)
+    Results = []
+    for Batch, Features, Latencies in FeatureBatches([FEName], FullPaths, BatchSize, Cache, Workers=2):
+        for k, FullPath in enumerate(Batch):
+            FeatureVector = Features[FEName][k].tolist() if FEName in Features else None
+            Results.append((FullPath, FeatureVector))
+    Cache.Close()
+    return(Results)
 
 
 #
-# TwentyThirtyBPFLL()
-# This feature filters in the 20-30Hz band then computes line length. Filter is 100 pts long.
-def TwentyThirtyBPFLL(FullPath):
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output 
+# Path-based extractors
+# Load the clip file then call the matching *Clip() extractor
+def PeakDetect(FullPath):
+    return(PeakDetectClip(*LoadClip(FullPath)))
 
-    # Read in the digital filter coeficients and place in ndarrays
-    FilterInfo=spio.loadmat('FilterSetTwentyThirtyBPF.mat')
+def TenTwentyBPF(FullPath):
+    return(TenTwentyBPFClip(*LoadClip(FullPath)))
 
-    FilterCoefI = FilterInfo['FilterCoefI'].flatten()
-    FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
-    
-    ILineLength=0.0
-    QLineLength=0.0
+def TenTwentyUpslopeBPF(FullPath):
+    return(TenTwentyUpslopeBPFClip(*LoadClip(FullPath)))
 
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        Ifilt = np.convolve(FilterCoefI, TempDataArray[:,i])     
-        Qfilt = np.convolve(FilterCoefQ, TempDataArray[:,i])
-        
-        
-        for j in range (1, Ifilt.size):
-            ILineLength = np.abs(Ifilt[j]-Ifilt[j-1])
-            QLineLength = np.abs(Qfilt[j]-Qfilt[j-1])
-        
-        FeatureOutput[i] = np.log10(ILineLength+QLineLength)
-        FeatureOutput[i] = bender(FeatureOutput[i], -2.7, 3.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span      
+def TenTwentyDownslopeBPF(FullPath):
+    return(TenTwentyDownslopeBPFClip(*LoadClip(FullPath)))
 
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
+def TenThirtyBPFLL(FullPath):
+    return(TenThirtyBPFLLClip(*LoadClip(FullPath)))
 
-    #Return feature vector in form of a list
-    return(FeatureList)
+def TwentyThirtyBPFLL(FullPath):
+    return(TwentyThirtyBPFLLClip(*LoadClip(FullPath)))
 
 def difPeakDetect(FullPath):
-    #print('Entering 1difPeakDetect()')
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
+    return(difPeakDetectClip(*LoadClip(FullPath)))
 
-    Fsample = float(TempClipData['freq'])
-    dt = 1.0/Fsample
-    TimeValues = np.arange(0.0, 1.0, dt)
-    LastChan = int(TempDataArray.shape[1])
-    Channels = np.arange(0, LastChan, 1)
-
-    FeatureOutput = np.zeros(LastChan)
-    DifferenceArray = np.zeros((TempDataArray.shape[0] - 1, TempDataArray.shape[1]))
-
-    for i in Channels:
-        DifferenceArray[:,i] = np.diff(TempDataArray[:,i])
-
-    # Read in the digital filter coeficients
-    FilterInfo=spio.loadmat('FilterSet.mat')
-
-    FilterCoefI = FilterInfo['FilterCoefI'].flatten()
-    FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
-
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        #FeatureOutput[i]=TempDataArray[:,i].max()
-        FeatureOutput[i]=np.log10(DifferenceArray[:,i].max()*DifferenceArray[:,i].max())
-        FeatureOutput[i] = bender(FeatureOutput[i], 4, 4.5)
-        '''
-        Iproduct = FilterCoefI*TempDataArray[:,i]
-        Isum=np.sum(Iproduct[i])
-        
-        Qproduct = FilterCoefQ*TempDataArray[:,i]
-        Qsum=np.sum(Qproduct)
-        
-        FeatureOutput[i] = np.log10( np.sqrt(Isum*Isum + Qsum*Qsum) )
-        '''
+def difTenTwentyBPFLL(FullPath):
+    return(difTenTwentyBPFLLClip(*LoadClip(FullPath)))
 
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
+def ChannelPeakDeviation(FullPath):
+    return(ChannelPeakDeviationClip(*LoadClip(FullPath)))
 
-    #Return feature vector in form of a list
-    return(FeatureList)
+def difChannelPeakDeviation(FullPath):
+    return(difChannelPeakDeviationClip(*LoadClip(FullPath)))
 
-def difTenTwentyBPFLL(FullPath):
-    #print('Entering 1difPeakDetect()')
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
 
-    Fsample = float(TempClipData['freq'])
-    dt = 1.0/Fsample
-    TimeValues = np.arange(0.0, 1.0, dt)
-    LastChan = int(TempDataArray.shape[1])
-    Channels = np.arange(0, LastChan, 1)
+#
+# IsEarly()
+# Ictal clips with a latency below 16 seconds (EarlyLatency) count as early ictal
+def IsEarly(Latency):
+    early = 0
+    if Latency is not None:
+        if Latency < EarlyLatency:
+            early = 1
+    return(early)
 
-    FeatureOutput = np.zeros(LastChan)
-    DifferenceArray = np.zeros((TempDataArray.shape[0] - 1, TempDataArray.shape[1]))
 
-    for i in Channels:
-        DifferenceArray[:,i] = np.diff(TempDataArray[:,i])
+#
+# Clip extractors
+# Each runs the matching registered feature on a single clip and returns the
+# per-channel values as a list.  PeakDetectClip() also returns
+# the early ictal flag derived from the latency.
+def PeakDetectClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('Peak Detect', DataArray, Fsample), IsEarly(Latency))
 
-    # Read in the digital filter coeficients and place in ndarrays
-    FilterInfo=spio.loadmat('FilterSetTenTwentyBPF.mat')
+def TenTwentyBPFClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('10-20Hz BPF', DataArray, Fsample))
 
-    FilterCoefI = FilterInfo['FilterCoefI'].flatten()
-    FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
+def TenTwentyUpslopeBPFClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('10-20Hz Upslope', DataArray, Fsample))
 
-    ILineLength=0.0
-    QLineLength=0.0
+def TenTwentyDownslopeBPFClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('10-20Hz Downslope', DataArray, Fsample))
 
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        Ifilt = np.convolve(FilterCoefI, DifferenceArray[:,i])     
-        Qfilt = np.convolve(FilterCoefQ, DifferenceArray[:,i])
-        
-        
-        for j in range (1, Ifilt.size):
-            ILineLength = np.abs(Ifilt[j]-Ifilt[j-1])
-            QLineLength = np.abs(Qfilt[j]-Qfilt[j-1])
-        
-        FeatureOutput[i] = np.log10(ILineLength+QLineLength)
-        FeatureOutput[i] = bender(FeatureOutput[i], -2.7, 3.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span      
+def TenThirtyBPFLLClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('10-30Hz Line Length', DataArray, Fsample))
 
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
+def TwentyThirtyBPFLLClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('20-30Hz Line Length', DataArray, Fsample))
 
-    #Return feature vector in form of a list
-    return(FeatureList)
+def difPeakDetectClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('Difference Peak', DataArray, Fsample))
 
-def ChannelPeakDeviation(FullPath):
-    #print('Entering ChannelPeakDeviation()')
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output
+def difTenTwentyBPFLLClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('Difference 10-20Hz Line Length', DataArray, Fsample))
 
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        #FeatureOutput[i]=TempDataArray[:,i].max()
-        FeatureOutput[i]=np.log10(TempDataArray[:,i].max()*TempDataArray[:,i].max())
-        FeatureOutput[i] = bender(FeatureOutput[i], 4.8, 3.0)               #Limit to range of 0 to 1.  Second arg is mean, third is span 
-        
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
+def ChannelPeakDeviationClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('Channel Peak Deviation', DataArray, Fsample))
 
-    stdev = np.std(FeatureList)
-    for i in range(0, len(FeatureList)):
-        FeatureList[i] = stdev
-    #Return feature vector in form of a list
-    return(FeatureList)
+def difChannelPeakDeviationClip(DataArray, Fsample, Latency=None):
+    return(ClipFeature('Difference Channel Peak Deviation', DataArray, Fsample))
 
-def difChannelPeakDeviation(FullPath):
-    #print('Entering difChannelPeakDeviation()')
-    TempClipData = spio.loadmat(FullPath)
-    TempDataArray = TempClipData['data']
-    TempDataArray = TempDataArray.transpose()
-
-    Fsample = float(TempClipData['freq'])       #Sampling frequency
-    dt = 1.0/Fsample                            #Time between samples
-    TimeValues = np.arange(0.0, 1.0, dt)        #Construct ndarray of time values
-    LastChan = int(TempDataArray.shape[1])      #Last channel number
-    Channels = np.arange(0, LastChan,1)         #List of channel numbers
-    
-    FeatureOutput = np.zeros(LastChan)          #Initialize the output
-    DifferenceArray = np.zeros((TempDataArray.shape[0] - 1, TempDataArray.shape[1]))
 
-    for i in Channels:
-        DifferenceArray[:,i] = np.diff(TempDataArray[:,i])
-
-    # Calculate the feature values for each channel       
-    for i in Channels:
-        #FeatureOutput[i]=TempDataArray[:,i].max()
-        FeatureOutput[i]=np.log10(DifferenceArray[:,i].max()*DifferenceArray[:,i].max())
-        FeatureOutput[i] = bender(FeatureOutput[i], 4.8, 3)               #Limit to range of 0 to 1.  Second arg is mean, third is span 
-        
-    FeatureList = FeatureOutput.tolist()        #Convert ndarray to list.  The returned value will be appended other values; this would be very inefficent with ndarray
+#
+# ClipFeature()
+# Run one registered feature on a single clip and return its values as a list
+def ClipFeature(FEName, DataArray, Fsample):
+    return(ExtractFeatures([FEName], DataArray, Fsample)[FEName])
 
-    stdev = np.std(FeatureList)
-    for i in range(0, len(FeatureList)):
-        FeatureList[i] = stdev
-        FeatureList[i] = bender(FeatureList[i], .055, .1)
-    
-    #Return feature vector in form of a list
-    return(FeatureList)
-    
-    
 
 ###############################################################################
 # Main Loop
@@ -0,0 +1,233 @@
+"""
+FeatureTable.py: Per-patient table of training points.
+
+Trainer.py writes every training point of a patient to one table file,
+<patient>.ftab, instead of one .mat file per point.  The file starts with a
+HeaderSize-byte header (magic, format version, the feature names and the
+resampling the clips were featurized at, as JSON) followed by fixed-size
+binary records, one per point:
+
+    data      the point's feature values, one float64 per feature
+    label     the point's class: b'i' interictal, b'e' early or b'l' late ictal
+    segment   segment number of the clip the point was computed from
+    mtime     modification time of the clip file when it was featurized
+
+Records are only ever appended (or cut back to a count a resumed run knows to
+be complete, with Truncate()), so a table can be written one batch at a time
+and extended by later runs.  A clip that changed after it was featurized gets
+a new record; the newest record of each clip (see CurrentRows()) is the one
+that counts.  LoadTable() reads the whole table in one read
+into a NumPy structured array whose fields are the columns:
+
+    Table, FENames = LoadTable('E:/training results 5/Dog_1.ftab')
+    IPoints = Table['data'][Table['label'] == b'i']         #(points, features)
+"""
+
+import os
+import json
+
+import numpy as np
+
+from ClipStore import reSegment
+
+
+# Table file name extension
+TableSuffix = '.ftab'
+
+# Bytes taken by the header at the start of a table file
+HeaderSize = 4096
+
+# First bytes of a table file, and the version of the record layout.  Version 1
+# tables (no mtime column) can still be read
+Magic = b'FTAB'
+FormatVersion = 2
+
+
+#####################################################################################
+# Feature Table Class
+#####################################################################################
+class FeatureTable():
+
+    #
+    # Class constructor, opens the table at TablePath for appending.  When FENames is given
+    # a new, empty table is created with those feature columns, replacing any old one.
+    # Resampling records how the clips were resampled before they were featurized: None for
+    # clips as recorded, or [frequency, Resampler.py mode] (see Trainer.py's resamplefreq)
+    #
+    def __init__(self, TablePath, FENames=None, Resampling=None):
+        self.TablePath = TablePath
+        if FENames is not None:
+            self.FENames = list(FENames)
+            self.Resampling = Resampling
+            with open(TablePath, 'wb') as TableFile:
+                TableFile.write(PackHeader(self.FENames, Resampling))
+        else:
+            with open(TablePath, 'rb') as TableFile:
+                Header = TableFile.read(HeaderSize)
+            self.FENames, Version = UnpackHeader(Header)
+            self.Resampling = HeaderInfo(Header).get('resampling')
+            if Version != FormatVersion:
+                raise ValueError('Cannot append to a version %d feature table' % Version)
+        self.Dtype = RecordDtype(len(self.FENames))
+        self.TableFile = open(TablePath, 'ab')
+        self.Truncate(self.Count())                     #Drop a record left incomplete by an interrupted write
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *Exc):
+        self.Close()
+
+    #
+    # Append(): add points to the end of the table and sync them to disk.  Points is
+    # (points, features); Labels, Segments and Mtimes hold one entry per point
+    #
+    def Append(self, Points, Labels, Segments, Mtimes=0.0):
+        Records = np.zeros(len(Labels), dtype=self.Dtype)
+        Records['data'] = Points
+        Records['label'] = Labels
+        Records['segment'] = Segments
+        Records['mtime'] = Mtimes
+        self.TableFile.write(Records.tobytes())
+        self.TableFile.flush()
+        os.fsync(self.TableFile.fileno())
+
+    #
+    # Truncate(): keep only the first Count points, dropping those appended after them
+    #
+    def Truncate(self, Count):
+        self.TableFile.truncate(HeaderSize + Count*self.Dtype.itemsize)
+
+    #
+    # Count(): number of complete points in the table
+    #
+    def Count(self):
+        return((os.path.getsize(self.TablePath) - HeaderSize)//self.Dtype.itemsize)
+
+    def Close(self):
+        self.TableFile.close()
+
+
+#
+# RecordDtype()
+# Record layout of a table with Features feature columns
+def RecordDtype(Features, Version=FormatVersion):
+    Fields = [('data', '<f8', (Features,)), ('label', 'S1'), ('segment', '<i4')]
+    if Version >= 2:
+        Fields.append(('mtime', '<f8'))
+    return(np.dtype(Fields))
+
+
+#
+# PackHeader()
+# Header bytes of a table with the feature columns FENames, made from clips resampled as
+# Resampling (see FeatureTable)
+def PackHeader(FENames, Resampling=None):
+    Info = {'version': FormatVersion, 'features': list(FENames), 'resampling': Resampling}
+    Header = Magic + json.dumps(Info).encode('utf-8')
+    if len(Header) > HeaderSize:
+        raise ValueError('Too many feature names for the table header')
+    return(Header.ljust(HeaderSize, b' '))
+
+
+#
+# UnpackHeader()
+# (feature names, format version) held in the header bytes of a table
+def UnpackHeader(Header):
+    Info = HeaderInfo(Header)
+    if Info['version'] > FormatVersion:
+        raise ValueError('Feature table version %d, expected %d' % (Info['version'], FormatVersion))
+    return(Info['features'], Info['version'])
+
+
+#
+# HeaderInfo()
+# Everything held in the header bytes of a table, as a dict.  Tables written before the
+# resampling was recorded have no 'resampling' entry; their clips were featurized as recorded
+def HeaderInfo(Header):
+    if Header[:len(Magic)] != Magic:
+        raise ValueError('Not a feature table')
+    return(json.loads(Header[len(Magic):].decode('utf-8')))
+
+
+#
+# TableFeatures()
+# Feature names of the table at TablePath, read from its header
+def TableFeatures(TablePath):
+    with open(TablePath, 'rb') as TableFile:
+        return(UnpackHeader(TableFile.read(HeaderSize))[0])
+
+
+#
+# TableResampling()
+# Resampling of the clips of the table at TablePath (see FeatureTable), read from its header
+def TableResampling(TablePath):
+    with open(TablePath, 'rb') as TableFile:
+        return(HeaderInfo(TableFile.read(HeaderSize)).get('resampling'))
+
+
+#
+# TablePath()
+# File name of a patient's table in Folder
+def TablePath(Folder, Patient):
+    return(os.path.join(Folder, Patient + TableSuffix))
+
+
+#
+# TablePatients()
+# Patients with a table in Folder, sorted
+def TablePatients(Folder):
+    return(sorted(fn[:-len(TableSuffix)] for fn in os.listdir(Folder) if fn.endswith(TableSuffix)))
+
+
+#
+# LoadTable()
+# Read a whole table.  Returns (Table, FENames): a structured array with the fields data,
+# label, segment and mtime (data, label and segment for version 1 tables), and the feature
+# names of the data columns.  With Current only the newest record of each clip is kept
+# (see CurrentRows()), otherwise every record is.  A record left incomplete by an interrupted
+# write is ignored
+def LoadTable(TablePath, Current=True):
+    with open(TablePath, 'rb') as TableFile:
+        Contents = TableFile.read()
+    FENames, Version = UnpackHeader(Contents[:HeaderSize])
+    Dtype = RecordDtype(len(FENames), Version)
+    Count = (len(Contents) - HeaderSize)//Dtype.itemsize
+    Table = np.frombuffer(Contents, dtype=Dtype, count=Count, offset=HeaderSize)
+    if Current:
+        Table = Table[CurrentRows(Table)]
+    return(Table, FENames)
+
+
+#
+# ClipKeys()
+# Clip identity from segment numbers and interictal flags: the segment number times two,
+# plus one for an interictal clip (ictal and interictal clips are numbered separately)
+def ClipKeys(Segments, Interictal):
+    return(np.asarray(Segments, dtype=np.int64)*2 + np.asarray(Interictal, dtype=np.int64))
+
+
+#
+# RowKeys()
+# Clip identity (see ClipKeys()) of every row of a table
+def RowKeys(Table):
+    return(ClipKeys(Table['segment'], Table['label'] == b'i'))
+
+
+#
+# FileKey()
+# Clip identity (see ClipKeys()) of the rows made from the clip file FileName
+def FileKey(FileName):
+    Match = reSegment.match(os.path.basename(FileName))
+    return(int(ClipKeys(int(Match.group(3)), Match.group(2) == 'interictal')))
+
+
+#
+# CurrentRows()
+# Mask of the rows of a table that are the newest record of their clip
+def CurrentRows(Table):
+    Keys = RowKeys(Table)
+    Current = np.zeros(len(Keys), dtype=bool)
+    Unique, Last = np.unique(Keys[::-1], return_index=True)
+    Current[len(Keys) - 1 - Last] = True
+    return(Current)
@@ -1,15 +1,19 @@
 # Written by Alex McMaster
-"""The FeatureVisualizer.py script accepts a directory containing output files
-from Trainer.py and plots each file as a point in 3D Cartesian space.  Features
-are represented on the 3 axes, while segment class is represented by color as
-follows:
+"""The FeatureVisualizer.py script accepts a directory containing the feature
+tables written by Trainer.py and plots each training point in 3D Cartesian
+space.  Features are represented on the 3 axes, while segment class is
+represented by color as follows:
 
 Blue - Interictal
 Yellow - Early ictal
 Red - Late ictal"""
 
+from FeatureTable import LoadTable
+from FeatureTable import TablePath
+from FeatureTable import TablePatients
+
 import matplotlib.pyplot as plt
-import scipy.io as sio
+import numpy as np
 import time
 import os
 
@@ -20,53 +24,37 @@ dirpath = "E:/training results 5/"
 # can be set to "" to use all patients at once
 patient = "Dog_1"
 
-start = time.clock()
+start = time.perf_counter()
 
 ipoints = [] # interictal points
 epoints = [] # early ictal points
 lpoints = [] # late ictal points
 
-for dn in os.listdir(dirpath):
-    dirstart = time.clock()
-    fullpath = os.path.join(dirpath, dn)
+for dn in TablePatients(dirpath):
+    dirstart = time.perf_counter()
     if patient in dn:
-        for fn in os.listdir(fullpath):
-            if "test" not in fn:
-                
-                # full path and filename of input file
-                fullname = os.path.join(fullpath, fn)
-                
-                # create dict from input file
-                point = sio.loadmat(fullname)
-                
-                # separate classes
-                if point['type'] == 'i':
-                    ipoints.append(point['data'].tolist())
-                elif point['type'] == 'e':
-                    epoints.append(point['data'].tolist())
-                elif point['type'] == 'l':
-                    lpoints.append(point['data'].tolist())
-                else:
-                    print("Invalid point type.")
-    print("Processed", dn, "in", time.clock() - dirstart, "seconds.")
-
-print("Processed all directories in", time.clock() - start, "seconds")
+        
+        # load the patient's feature table in one read
+        table, tablefeatures = LoadTable(TablePath(dirpath, dn))
+        
+        # separate classes
+        ipoints.append(table['data'][table['label'] == b'i'])
+        epoints.append(table['data'][table['label'] == b'e'])
+        lpoints.append(table['data'][table['label'] == b'l'])
+    print("Processed", dn, "in", time.perf_counter() - dirstart, "seconds.")
+
+ipoints = np.concatenate(ipoints)
+epoints = np.concatenate(epoints)
+lpoints = np.concatenate(lpoints)
+
+print("Processed all directories in", time.perf_counter() - start, "seconds")
 
 # create scatter plot and fill with data
 fig = plt.figure()
 axis = fig.add_subplot(111, projection='3d')
-x = list(ipoints[i][0][0] for i in range(0, len(ipoints)))
-y = list(ipoints[i][0][1] for i in range(0, len(ipoints)))
-z = list(ipoints[i][0][2] for i in range(0, len(ipoints)))
-axis.scatter(x, y, z, c='b')
-x = list(epoints[i][0][0] for i in range(0, len(epoints)))
-y = list(epoints[i][0][1] for i in range(0, len(epoints)))
-z = list(epoints[i][0][2] for i in range(0, len(epoints)))
-axis.scatter(x, y, z, c='y')
-x = list(lpoints[i][0][0] for i in range(0, len(lpoints)))
-y = list(lpoints[i][0][1] for i in range(0, len(lpoints)))
-z = list(lpoints[i][0][2] for i in range(0, len(lpoints)))
-axis.scatter(x, y, z, c='r')
+axis.scatter(ipoints[:, 0], ipoints[:, 1], ipoints[:, 2], c='b')
+axis.scatter(epoints[:, 0], epoints[:, 1], epoints[:, 2], c='y')
+axis.scatter(lpoints[:, 0], lpoints[:, 1], lpoints[:, 2], c='r')
 xL = axis.set_xlabel('f1')
 yL = axis.set_ylabel('f2')
 zL = axis.set_zlabel('f3')
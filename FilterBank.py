@@ -0,0 +1,191 @@
+"""
+FilterBank.py: Process-wide registry of the band-pass filters used by the
+feature extractors.
+
+Every FilterSet*.mat file next to this module holds an I/Q pair of digital
+filter coefficients (FilterCoefI, FilterCoefQ).  The files are read once, the
+first time a filter is requested, and the pairs are stored as the rows of one
+contiguous complex matrix (FilterCoefI + 1j*FilterCoefQ).  Rows shorter than the
+longest filter are zero padded; Lengths holds the true length of each row.
+
+Extractors ask for their coefficients by band name, e.g.
+
+    FilterCoefI, FilterCoefQ = GetFilterBank().GetFilter('TenTwentyBPF')
+
+and the whole matrix (Coef) can be applied to a clip with a single matrix
+multiply when all bands are needed at once.
+
+The stored coefficients were designed for clips sampled at NativeFreq, and are
+what GetFilter() and GetCoef() return for those clips (zero padded when a longer
+filter is asked for).  For clips at any other sampling frequency (or shorter than
+the stored filter) they design an equivalent band-pass I/Q pair from the band's
+entry in BandSpecs with DesignCoef(), which keeps the most recently used designs
+in an LRU cache keyed by (spec, freq, length).  BandSpecs was fitted to the
+magnitude responses of the stored filters; CheckDesign() compares the designs at
+NativeFreq with them.
+
+The designs pass the same bands at any rate, but the feature values computed
+from them are not comparable across rates: the band energies sum over as many
+samples as the clip has, and line lengths and differences are taken per sample.
+The features' bender() constants were tuned at NativeFreq, so Trainer.py and
+Classifier.py refuse clips that are not featurized at that rate (resample them
+there, in memory or with Resampler.py, see FeatureExplorer.CheckClipFreq()).  The
+designs serve exploring native-rate clips, e.g. in FeatureExplorer.py.
+"""
+
+import os
+import functools
+
+import numpy as np
+import scipy.io as spio
+import scipy.signal
+
+
+# Folder holding the FilterSet*.mat files (this module's folder, not the CWD)
+FilterDir = os.path.dirname(os.path.abspath(__file__))
+
+# Band name -> coefficient file
+FilterFiles = {
+    'FilterSet': 'FilterSet.mat',
+    'TenTwentyBPF': 'FilterSetTenTwentyBPF.mat',
+    'TenTwentyUpslopeBPF': 'FilterSetTenTwentyUpslopeBPF.mat',
+    'TenTwentyDownslopeBPF': 'FilterSetTenTwentyDownslopeBPF.mat',
+    'TenThirtyBPF': 'FilterSetTenThirtyBPF.mat',
+    'TwentyThirtyBPF': 'FilterSetTwentyThirtyBPF.mat',
+    }
+
+# Sampling frequency the FilterSet*.mat coefficients were designed for (Hz)
+NativeFreq = 400.0
+
+# Band name -> ((low edge, high edge) in Hz, (gain at the low edge, gain at the high
+# edge), (width of the roll-off below the low edge, above the high edge) in Hz), used
+# to design the filters for other sampling frequencies.  The gain is linear across
+# the pass band and the roll-offs are widened further by the DesignWindow taper
+BandSpecs = {
+    'FilterSet': ((9.0, 19.6), (0.78, 3.09), (2.3, 1.7)),
+    'TenTwentyBPF': ((10.2, 20.0), (1.03, 1.03), (1.9, 1.7)),
+    'TenTwentyUpslopeBPF': ((10.0, 20.3), (0.3, 1.73), (1.7, 1.2)),
+    'TenTwentyDownslopeBPF': ((9.4, 20.4), (1.57, 0.45), (0.5, 1.2)),
+    'TenThirtyBPF': ((12.0, 28.8), (1.0, 0.99), (7.2, 6.4)),
+    'TwentyThirtyBPF': ((19.6, 30.3), (0.98, 1.03), (4.3, 5.0)),
+    }
+
+# Window tapering the ends of the designed filters
+DesignWindow = 'hann'
+
+
+#####################################################################################
+# Filter Bank Class
+#####################################################################################
+class FilterBank():
+
+    #
+    # Class constructor, reads every coefficient file in FilterFiles from Folder
+    #
+    def __init__(self, Folder=FilterDir, Files=FilterFiles):
+        self.Names = list(Files.keys())                                  #Band names, in row order
+        self.Index = dict((Name, k) for k, Name in enumerate(self.Names)) #Band name -> row of Coef
+
+        Pairs = []
+        for Name in self.Names:
+            FilterInfo = spio.loadmat(os.path.join(Folder, Files[Name]))
+            FilterCoefI = FilterInfo['FilterCoefI'].flatten()
+            FilterCoefQ = FilterInfo['FilterCoefQ'].flatten()
+            Pairs.append((FilterCoefI, FilterCoefQ))
+
+        self.Lengths = np.array([I.size for I, Q in Pairs])             #Number of taps in each filter
+        self.Coef = np.zeros((len(Pairs), self.Lengths.max()), dtype=np.complex128)
+        for k, (FilterCoefI, FilterCoefQ) in enumerate(Pairs):
+            self.Coef[k, :FilterCoefI.size] = FilterCoefI + 1j*FilterCoefQ
+
+    #
+    # GetCoef(): complex coefficients of one band, trimmed to the filter length.
+    # Fsample and Length default to the stored filter.  At NativeFreq the stored
+    # coefficients are returned, zero padded to a longer Length; at other sampling
+    # frequencies, or for a Length shorter than the stored filter, the coefficients
+    # are designed instead.  When only Fsample is given the length is scaled so the
+    # filter spans the same time as the stored one
+    #
+    def GetCoef(self, Name, Fsample=None, Length=None):
+        k = self.Index[Name]
+        if Fsample is None:
+            Fsample = NativeFreq
+        if Length is None:
+            Length = int(round(self.Lengths[k]*float(Fsample)/NativeFreq))
+
+        if float(Fsample) == NativeFreq and Length >= self.Lengths[k]:
+            if Length == self.Lengths[k]:
+                return(self.Coef[k, :self.Lengths[k]])
+            Coef = np.zeros(Length, dtype=np.complex128)
+            Coef[:self.Lengths[k]] = self.Coef[k, :self.Lengths[k]]
+            return(Coef)
+
+        return(DesignCoef(BandSpecs[Name], float(Fsample), int(Length)))
+
+    #
+    # GetFilter(): the (FilterCoefI, FilterCoefQ) pair of one band
+    #
+    def GetFilter(self, Name, Fsample=None, Length=None):
+        Coef = self.GetCoef(Name, Fsample, Length)
+        return(Coef.real, Coef.imag)
+
+
+_Bank = None
+
+#
+# GetFilterBank()
+# Return the process-wide filter bank, loading it on first use
+def GetFilterBank():
+    global _Bank
+    if _Bank is None:
+        _Bank = FilterBank()
+    return(_Bank)
+
+
+#
+# DesignCoef()
+# Design a complex band-pass filter (FilterCoefI + 1j*FilterCoefQ) with the same
+# conventions as the stored filter sets: pass band on the negative frequencies
+# with a gain of 2 (the I path is a real band-pass filter and the Q path its
+# quadrature), linear phase centred on the middle tap, window-tapered ends.
+# Spec is a BandSpecs entry.  Designs are memoized; the returned array is read-only
+# because it is shared.
+@functools.lru_cache(maxsize=64)
+def DesignCoef(Spec, Fsample, Length):
+    (Low, High), (LowGain, HighGain), (LowTransition, HighTransition) = Spec
+    Nyquist = Fsample/2.0
+    if High + HighTransition >= Nyquist:
+        raise ValueError('Band %s does not fit below the Nyquist frequency of %g Hz' % ((Low, High), Nyquist))
+
+    # Sample the wanted response densely, on the negative frequencies
+    NFFT = 8*Length
+    Freqs = np.fft.fftfreq(NFFT, 1.0/Fsample)
+    Gain = np.interp(-Freqs, [max(Low - LowTransition, 0.0), Low, High, High + HighTransition],
+                     [0.0, LowGain, HighGain, 0.0], left=0.0, right=0.0)
+    Centre = Length//2
+    Response = 2.0*Gain*np.exp(-2j*np.pi*Freqs*Centre/Fsample)
+
+    # Impulse response, truncated to Length taps and tapered with a window
+    Coef = np.fft.ifft(Response)[:Length]*scipy.signal.get_window(DesignWindow, Length, fftbins=False)
+    Coef = np.ascontiguousarray(Coef, dtype=np.complex128)
+    Coef.flags.writeable = False
+    return(Coef)
+
+
+#
+# CheckDesign()
+# Compare the magnitude response of every band's DesignCoef() design at NativeFreq, as
+# long as the stored filter, with that of the stored filter, on NFFT frequencies.
+# Returns (Passed, Deviations): Deviations maps band name to the largest difference
+# relative to the stored filter's peak gain, and Passed is True when none is above
+# Tolerance
+def CheckDesign(Tolerance=0.05, NFFT=4096):
+    Bank = GetFilterBank()
+    Deviations = {}
+    for Name in Bank.Names:
+        k = Bank.Index[Name]
+        Stored = np.abs(np.fft.fft(Bank.Coef[k, :Bank.Lengths[k]], NFFT))
+        Designed = np.abs(np.fft.fft(DesignCoef(BandSpecs[Name], NativeFreq, int(Bank.Lengths[k])), NFFT))
+        Deviations[Name] = float(np.max(np.abs(Designed - Stored))/np.max(Stored))
+    Passed = all(Deviations[Name] <= Tolerance for Name in Deviations)
+    return(Passed, Deviations)
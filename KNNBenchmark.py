@@ -0,0 +1,89 @@
+"""
+KNNBenchmark.py: Speed and accuracy of the KNNModel search settings.
+
+Pools the training points of every feature table in a training folder (or,
+with no folder, draws random points), holds out a share of them as queries,
+and classifies the queries with the exact search and with each approximate
+Eps setting, for each metric.  For every setting it reports the queries per
+second and how closely the (ictal, early) outputs agree with the exact search
+of the same metric: the share of queries with identical outputs and the mean
+absolute difference.
+
+    python KNNBenchmark.py [<training folder>]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from FeatureTable import LoadTable
+from FeatureTable import TablePath
+from FeatureTable import TablePatients
+from KNNEngine import KNNModel
+
+
+# Eps settings tried against the exact search
+EpsSettings = (0.0, 0.1, 0.5, 1.0, 2.0)
+
+# Metrics tried
+Metrics = ('euclidean', 'manhattan', 'scaled')
+
+# Share of the points held out as queries
+QueryShare = 0.2
+
+# Number of random points drawn when no training folder is given
+RandomPoints = 200000
+
+
+#
+# PooledPoints()
+# (Points, Labels) of every table in TrainingDir, or random ones when TrainingDir is None
+def PooledPoints(TrainingDir=None):
+    if TrainingDir is None:
+        Random = np.random.default_rng(0)
+        Labels = Random.choice(np.array([b'i', b'e', b'l']), size=RandomPoints, p=[0.8, 0.1, 0.1])
+        Centres = {b'i': 0.4, b'e': 0.6, b'l': 0.55}
+        Points = np.array([Centres[Label] for Label in Labels])[:, np.newaxis] + 0.15*Random.standard_normal((RandomPoints, 3))
+        return(Points, Labels)
+
+    Tables = [LoadTable(TablePath(TrainingDir, Patient))[0] for Patient in TablePatients(TrainingDir)]
+    Table = np.concatenate(Tables)
+    return(Table['data'], Table['label'])
+
+
+#
+# TimeQueries()
+# (Ictal, Early, queries per second) of a model over Queries
+def TimeQueries(Model, Queries):
+    Start = time.perf_counter()
+    Ictal, Early = Model.Probabilities(Queries)
+    return(Ictal, Early, len(Queries)/(time.perf_counter() - Start))
+
+
+#
+# Benchmark()
+# Print the speed and agreement of every metric and Eps setting
+def Benchmark(Points, Labels):
+    Random = np.random.default_rng(1)
+    IsQuery = Random.random(len(Labels)) < QueryShare
+    Queries = Points[IsQuery]
+    print('%d training points, %d queries' % ((~IsQuery).sum(), IsQuery.sum()))
+    print('%-10s %6s %14s %10s %10s' % ('metric', 'eps', 'queries/sec', 'identical', 'mean diff'))
+
+    for Metric in Metrics:
+        Model = KNNModel(Points[~IsQuery], Labels[~IsQuery], Metric=Metric)
+        ExactIctal, ExactEarly, Rate = TimeQueries(Model, Queries)
+        print('%-10s %6s %14.0f %10.4f %10.5f' % (Metric, 'exact', Rate, 1.0, 0.0))
+        for Eps in EpsSettings:
+            Ictal, Early, Rate = TimeQueries(Model.Configured(Eps=Eps), Queries)
+            Identical = np.mean((Ictal == ExactIctal) & (Early == ExactEarly))
+            Difference = np.mean(np.abs(Ictal - ExactIctal) + np.abs(Early - ExactEarly))/2
+            print('%-10s %6.2f %14.0f %10.4f %10.5f' % (Metric, Eps, Rate, Identical, Difference))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print('Usage: python KNNBenchmark.py [<training folder>]')
+        sys.exit(1)
+    Benchmark(*PooledPoints(sys.argv[1] if len(sys.argv) == 2 else None))
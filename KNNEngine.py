@@ -0,0 +1,183 @@
+"""
+KNNEngine.py: k-nearest-neighbour classification of feature points.
+
+A KNNModel is built once per patient from the labelled training points (see
+FeatureTable.py) and keeps one KD-tree (scipy.spatial.cKDTree) per class.  A
+batch of query points is answered with one tree query per class: the K nearest
+points of each class are found, classes with fewer than K points are padded
+with points at distance Pad, and the K nearest of the pooled candidates vote.
+
+On equal distances a late ictal neighbour is taken before an early ictal one,
+and an early ictal one before an interictal one (LabelOrder).  Together with
+the padding this gives exactly the votes of the per-class sort and merge that
+Classifier.py used to do by hand.
+
+    Model = KNNModel(Table['data'], Table['label'])
+    Ictal, Early = Model.Probabilities(TestPoints)
+
+The defaults (K=10, Pad=100, Euclidean distance, one vote per neighbour, exact
+search) are those of the original classifier.  Other settings:
+
+    Metric      'euclidean', 'manhattan', or 'scaled': Euclidean distance after
+                dividing each feature by Scale (default: its standard deviation
+                over the training points)
+    Weighting   'uniform' (one vote per neighbour) or 'distance' (votes
+                weighted by 1/distance)
+    Eps         approximate search: the neighbours found are within a factor
+                1 + Eps of the true K nearest distances (see cKDTree.query()).
+                Much faster on large pooled training sets; 0 is exact
+
+KNNBenchmark.py measures the speed and accuracy of these settings.
+
+Points added later with Add() are held in a per-class pending buffer that is
+searched by brute force alongside the tree; a class's tree is rebuilt only
+once its buffer grows past RebuildFraction of the tree's size, so adding a few
+points costs a few distance computations per query rather than a rebuild.
+"""
+
+import copy
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# Class labels, in tie-break order (see above)
+LabelOrder = (b'l', b'e', b'i')
+
+# Pending points, as a fraction of a class's tree size, that trigger a rebuild of the tree
+RebuildFraction = 0.1
+
+# Metric name -> Minkowski p of the distance
+MetricNorms = {'euclidean': 2, 'manhattan': 1, 'scaled': 2}
+
+# Weightings accepted by KNNModel
+Weightings = ('uniform', 'distance')
+
+# Settings that only change how a model is queried, not its trees (see KNNModel.Configured())
+QuerySettings = ('K', 'Pad', 'Weighting', 'Eps')
+
+# Distances below this count as this in distance weighting (avoids dividing by zero)
+WeightFloor = 1e-9
+
+
+#####################################################################################
+# KNN Model Class
+#####################################################################################
+class KNNModel():
+
+    #
+    # Class constructor.  Points is (points, features) and Labels holds the class label of each
+    # point (b'i', b'e' or b'l'); K is the number of voting neighbours.  See above for the others
+    #
+    def __init__(self, Points, Labels, K=10, Pad=100.0, Metric='euclidean', Weighting='uniform', Eps=0.0, Scale=None):
+        if Metric not in MetricNorms:
+            raise ValueError('Unknown metric ' + str(Metric))
+        if Weighting not in Weightings:
+            raise ValueError('Unknown weighting ' + str(Weighting))
+        self.Points = np.ascontiguousarray(Points, dtype=np.float64)   #Training points, (points, features)
+        self.Labels = np.asarray(Labels).astype('S1')                   #Label of each training point
+        self.K = K
+        self.Pad = Pad
+        self.Metric = Metric
+        self.Norm = MetricNorms[Metric]
+        self.Weighting = Weighting
+        self.Eps = Eps
+        self.Features = self.Points.shape[1]
+
+        # Per-feature divisors of the scaled metric, fixed when the model is built
+        self.Scale = np.ones(self.Features)
+        if Metric == 'scaled':
+            self.Scale = np.asarray(Scale, dtype=np.float64) if Scale is not None else self.Points.std(axis=0)
+            self.Scale[self.Scale == 0] = 1.0
+        self.Trees = [None]*len(LabelOrder)             #One tree per label of LabelOrder, None for an empty class
+        self.Pending = [None]*len(LabelOrder)           #Points of each class added since its tree was built
+        for j in range(len(LabelOrder)):
+            self.Rebuild(j)
+
+    #
+    # Configured(): a copy of the model with other query Settings (see QuerySettings).  The copy
+    # shares the points and trees with the model, which is left as it is
+    #
+    def Configured(self, **Settings):
+        for Name in Settings:
+            if Name not in QuerySettings:
+                raise ValueError(Name + ' is not a query setting')
+        if Settings.get('Weighting', self.Weighting) not in Weightings:
+            raise ValueError('Unknown weighting ' + str(Settings['Weighting']))
+        Model = copy.copy(self)
+        Model.Trees = list(self.Trees)
+        Model.Pending = list(self.Pending)
+        for Name, Value in Settings.items():
+            setattr(Model, Name, Value)
+        return(Model)
+
+    #
+    # Rebuild(): build the tree of class j (an index into LabelOrder) from all its points
+    #
+    def Rebuild(self, j):
+        ClassPoints = self.Points[self.Labels == LabelOrder[j]]/self.Scale
+        self.Trees[j] = cKDTree(ClassPoints) if len(ClassPoints) else None
+        self.Pending[j] = np.zeros((0, self.Features))
+
+    #
+    # Add(): add labelled points to the model without rebuilding it.  A class's tree is
+    # rebuilt once its pending points exceed RebuildFraction of the tree
+    #
+    def Add(self, Points, Labels):
+        Points = np.asarray(Points, dtype=np.float64).reshape(-1, self.Features)
+        Labels = np.asarray(Labels).astype('S1')
+        self.Points = np.concatenate((self.Points, Points))
+        self.Labels = np.concatenate((self.Labels, Labels))
+        for j, Label in enumerate(LabelOrder):
+            self.Pending[j] = np.concatenate((self.Pending[j], Points[Labels == Label]/self.Scale))
+            TreeSize = 0 if self.Trees[j] is None else self.Trees[j].n
+            if len(self.Pending[j]) > RebuildFraction*TreeSize:
+                self.Rebuild(j)
+
+    #
+    # Votes(): neighbour votes of a batch of (queries, features) points.  Returns a
+    # (queries, len(LabelOrder)) array; column j holds the votes of the neighbours labelled
+    # LabelOrder[j] (counts, or summed weights with distance weighting)
+    #
+    def Votes(self, Queries):
+        Queries = np.asarray(Queries, dtype=np.float64).reshape(-1, self.Features)/self.Scale
+        Count = Queries.shape[0]
+
+        # K nearest of every class, padded, side by side: (queries, classes*K)
+        Distances = np.full((Count, len(LabelOrder)*self.K), self.Pad)
+        for j, Tree in enumerate(self.Trees):
+            if Tree is not None:
+                ClassDistances = Tree.query(Queries, k=self.K, p=self.Norm, eps=self.Eps)[0].reshape(Count, self.K)
+                if len(self.Pending[j]):
+                    Differences = np.abs(Queries[:, np.newaxis, :] - self.Pending[j][np.newaxis])
+                    if self.Norm == 1:
+                        PendingDistances = Differences.sum(axis=2)
+                    else:
+                        PendingDistances = np.sqrt((Differences**2).sum(axis=2))
+                    ClassDistances = np.sort(np.concatenate((ClassDistances, PendingDistances), axis=1), axis=1)[:, :self.K]
+                ClassDistances[np.isinf(ClassDistances)] = self.Pad
+                Distances[:, j*self.K:(j + 1)*self.K] = ClassDistances
+        Priority = np.repeat(np.arange(len(LabelOrder)), self.K)
+
+        # K nearest candidates, ties going to the class earlier in LabelOrder
+        Order = np.lexsort((np.broadcast_to(Priority, Distances.shape), Distances), axis=1)[:, :self.K]
+        Nearest = Priority[Order]
+        if self.Weighting == 'distance':
+            Weights = 1.0/np.maximum(np.take_along_axis(Distances, Order, axis=1), WeightFloor)
+        else:
+            Weights = np.ones(Nearest.shape)
+        Votes = np.zeros((Count, len(LabelOrder)))
+        for j in range(len(LabelOrder)):
+            Votes[:, j] = (Weights*(Nearest == j)).sum(axis=1)
+        return(Votes)
+
+    #
+    # Probabilities(): (Ictal, Early) for a batch of points: the share of the votes that are
+    # not interictal, and the share that are early ictal
+    #
+    def Probabilities(self, Queries):
+        Votes = self.Votes(Queries)
+        Total = Votes.sum(axis=1)
+        Ictal = 1.0 - Votes[:, LabelOrder.index(b'i')]/Total
+        Early = Votes[:, LabelOrder.index(b'e')]/Total
+        return(Ictal, Early)
@@ -0,0 +1,293 @@
+"""
+ModelArtifact.py: Compiled per-patient classification models.
+
+CompileModel() turns a patient's feature table (see FeatureTable.py) into one
+model file, <patient>.knn, holding the stacked training points, their labels,
+the built KNNModel (KD-trees included) and the configuration the points were
+made with: feature names and versions, the resampling of the clips the points
+were featurized from (see FeatureTable.py), the KNNModel settings (K, padding
+distance, metric, Scale, weighting and Eps), the number of table records
+the model has taken in and a digest of those records.
+
+UpdateModel() brings a model up to date with records appended to its table
+since (new clips featurized by an incremental Trainer.py run): they are added
+to the model with KNNModel.Add() instead of rebuilding it.  The model is
+compiled again from the table instead when the records it holds are no longer
+the first records of the table (a full Trainer.py run rewrote the table, new
+clips sorting among the old ones, or it was cut back), or when a new record
+replaces one the model already holds (a clip that changed).
+
+The file is a pickle whose NumPy arrays are stored out of band, after the
+pickle stream, each aligned to Alignment bytes:
+
+    Magic, header length (8 bytes), JSON header (format version, config and
+    the offset and size of every array), pickle stream, arrays
+
+The header is padded so the pickle stream starts on an Alignment boundary, and
+the array offsets count from there.
+
+LoadModel() memory-maps the file and unpickles the model on top of the map, so
+the points and labels are views of the file rather than copies: loading is one
+map of one file and the points are read as they are needed.  The KD-trees are
+restored by cKDTree's own unpickling, which decides whether their arrays stay
+views of the map (SciPy 1.13 keeps them) or are copied (other versions may),
+so only the points and labels are sure to be mapped.  Any process can
+load the same file.  A model about to be updated is read into memory instead
+(Mapped=False), because a mapped file cannot be replaced on Windows.
+
+    Model, Config = LoadModel(ModelPath('E:/models/', 'Dog_1'))
+    Ictal, Early = Model.Probabilities(TestPoints)
+
+Run as a script to compile the models of every table in a training folder:
+
+    python ModelArtifact.py <training folder> <model folder>
+"""
+
+import os
+import mmap
+import json
+import pickle
+import hashlib
+
+import numpy as np
+
+from FeatureEngine import FeatureVersion
+from FeatureTable import LoadTable
+from FeatureTable import TablePath
+from FeatureTable import TableFeatures
+from FeatureTable import TableResampling
+from FeatureTable import TablePatients
+from FeatureTable import CurrentRows
+from FeatureTable import RowKeys
+from KNNEngine import KNNModel
+from KNNEngine import QuerySettings
+
+
+# Model file name extension
+ModelSuffix = '.knn'
+
+# First bytes of a model file, and the version of its layout
+Magic = b'KNNMODEL'
+FormatVersion = 3
+
+# KNNModel settings of a model when none are given (those of the original classifier)
+DefaultSettings = {'K': 10, 'Pad': 100.0, 'Metric': 'euclidean', 'Weighting': 'uniform', 'Eps': 0.0, 'Scale': None}
+
+# Byte alignment of the arrays in a model file
+Alignment = 64
+
+
+#
+# SaveModel()
+# Write Model and its Config dict to a model file.  The file is written under a temporary
+# name and then renamed, so a reader never sees a partly written model
+def SaveModel(ModelPathname, Model, Config):
+    Buffers = []
+    Stream = pickle.dumps(Model, protocol=5, buffer_callback=Buffers.append)
+    Buffers = [Buffer.raw() for Buffer in Buffers]
+
+    # Lay out the arrays after the pickle stream; offsets count from the end of the header
+    Header = {'version': FormatVersion, 'config': Config, 'stream': len(Stream), 'buffers': []}
+    Offset = Align(len(Stream))
+    for Buffer in Buffers:
+        Header['buffers'].append((Offset, Buffer.nbytes))
+        Offset = Align(Offset + Buffer.nbytes)
+    HeaderBytes = json.dumps(Header).encode('utf-8')
+    HeaderBytes = HeaderBytes.ljust(Align(len(Magic) + 8 + len(HeaderBytes)) - len(Magic) - 8, b' ')
+
+    TempPath = ModelPathname + '.%d.tmp' % os.getpid()
+    with open(TempPath, 'wb') as ModelFile:
+        ModelFile.write(Magic)
+        ModelFile.write(len(HeaderBytes).to_bytes(8, 'little'))
+        ModelFile.write(HeaderBytes)
+        Start = ModelFile.tell()
+        ModelFile.write(Stream)
+        for (Offset, Size), Buffer in zip(Header['buffers'], Buffers):
+            ModelFile.write(b'\0'*(Start + Offset - ModelFile.tell()))
+            ModelFile.write(Buffer)
+    os.replace(TempPath, ModelPathname)
+
+
+#
+# LoadModel()
+# Map a model file and return (Model, Config).  The model's points and labels are read-only
+# views of the map.  With Mapped False the file is read into memory instead and left closed,
+# so it can be replaced while the model is in use
+def LoadModel(ModelPathname, Mapped=True):
+    with open(ModelPathname, 'rb') as ModelFile:
+        if Mapped:
+            Map = mmap.mmap(ModelFile.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            Map = bytearray(ModelFile.read())
+    View = memoryview(Map)
+
+    if bytes(View[:len(Magic)]) != Magic:
+        raise ValueError(ModelPathname + ' is not a model file')
+    Start = len(Magic) + 8
+    HeaderSize = int.from_bytes(View[len(Magic):Start], 'little')
+    Header = json.loads(bytes(View[Start:Start + HeaderSize]).decode('utf-8'))
+    if Header['version'] != FormatVersion:
+        raise ValueError('Model file version %d, expected %d' % (Header['version'], FormatVersion))
+
+    Start += HeaderSize
+    Stream = View[Start:Start + Header['stream']]
+    Buffers = [View[Start + Offset:Start + Offset + Size] for Offset, Size in Header['buffers']]
+    Model = pickle.loads(Stream, buffers=Buffers)
+    return(Model, Header['config'])
+
+
+#
+# ModelHeader()
+# JSON header of a model file (format version and config), None if it is not one
+def ModelHeader(ModelPathname):
+    with open(ModelPathname, 'rb') as ModelFile:
+        Start = ModelFile.read(len(Magic) + 8)
+        if Start[:len(Magic)] != Magic:
+            return(None)
+        return(json.loads(ModelFile.read(int.from_bytes(Start[len(Magic):], 'little')).decode('utf-8')))
+
+
+#
+# Align()
+# Round Offset up to a multiple of Alignment
+def Align(Offset):
+    return(-(-Offset//Alignment)*Alignment)
+
+
+#
+# ModelPath()
+# File name of a patient's model in Folder
+def ModelPath(Folder, Patient):
+    return(os.path.join(Folder, Patient + ModelSuffix))
+
+
+#
+# ModelSettings()
+# DefaultSettings overridden by Settings, with Scale as a list (or None) so the settings can be
+# kept in a model's JSON config
+def ModelSettings(Settings):
+    Settings = dict(DefaultSettings, **Settings)
+    if Settings['Scale'] is not None:
+        Settings['Scale'] = [float(Value) for Value in np.ravel(Settings['Scale'])]
+    return(Settings)
+
+
+#
+# SameTrees()
+# True if a model built with the settings Built has the trees that Settings would build: the
+# same metric and, for the scaled metric, the same Scale
+def SameTrees(Built, Settings):
+    Built = ModelSettings(Built)
+    Settings = ModelSettings(Settings)
+    if Built['Metric'] != Settings['Metric']:
+        return(False)
+    return(Settings['Metric'] != 'scaled' or Built['Scale'] == Settings['Scale'])
+
+
+#
+# FeaturesCurrent()
+# True if a model's Config was made with the features FENames, each at its current version
+def FeaturesCurrent(Config, FENames):
+    return(list(FENames) == Config['features'] and Config['versions'] == [FeatureVersion(FEName) for FEName in FENames])
+
+
+#
+# ResamplingCurrent()
+# True if a model's Config was made from clips resampled as those of the table at TablePathname
+def ResamplingCurrent(Config, TablePathname):
+    return(Config.get('resampling') == TableResampling(TablePathname))
+
+
+#
+# RowsDigest()
+# Digest of the records of a table, to tell whether a model's records are still the table's
+def RowsDigest(Rows):
+    return(hashlib.sha1(np.ascontiguousarray(Rows).tobytes()).hexdigest())
+
+
+#
+# CompileModel()
+# Build the model of one feature table and save it.  Settings are KNNModel keyword
+# arguments (see DefaultSettings).  Returns (Model, Config)
+def CompileModel(TablePathname, ModelPathname, **Settings):
+    Settings = ModelSettings(Settings)
+    Table, FENames = LoadTable(TablePathname, Current=False)
+    Current = Table[CurrentRows(Table)]
+    Model = KNNModel(Current['data'], Current['label'], **Settings)
+    Config = {'features': FENames,
+              'versions': [FeatureVersion(FEName) for FEName in FENames],
+              'resampling': TableResampling(TablePathname),
+              'settings': Settings,
+              'rows': len(Table),
+              'digest': RowsDigest(Table)}
+    SaveModel(ModelPathname, Model, Config)
+    return(Model, Config)
+
+
+#
+# UpdateModel()
+# Add the records appended to a feature table since Model was built from it, and save the
+# model.  Recompiles from the table instead when the model's records are not the first
+# records of the table any more, a new record replaces an older one, or the features or the
+# resampling have changed.  Model must not be mapped from ModelPathname (see LoadModel()).
+# Returns (Model, Config)
+def UpdateModel(TablePathname, ModelPathname, Model, Config):
+    Table, FENames = LoadTable(TablePathname, Current=False)
+    if not FeaturesCurrent(Config, FENames) or not ResamplingCurrent(Config, TablePathname) \
+       or len(Table) < Config['rows'] or RowsDigest(Table[:Config['rows']]) != Config.get('digest'):
+        return(CompileModel(TablePathname, ModelPathname, **Config['settings']))
+    New = Table[Config['rows']:]
+    if len(New) == 0:
+        os.utime(ModelPathname)                         #Up to date; spare the next load the check
+        return(Model, Config)
+
+    Keys = RowKeys(Table)
+    if np.isin(Keys[Config['rows']:], Keys[:Config['rows']]).any() or len(np.unique(Keys[Config['rows']:])) < len(New):
+        return(CompileModel(TablePathname, ModelPathname, **Config['settings']))
+
+    Model.Add(New['data'], New['label'])
+    Config['rows'] = len(Table)
+    Config['digest'] = RowsDigest(Table)
+    SaveModel(ModelPathname, Model, Config)
+    return(Model, Config)
+
+
+#
+# PatientModel()
+# The model of one patient, kept in ModelDir: mapped, or read and updated with UpdateModel()
+# when the patient's feature table in TrainingDir is newer.  Compiled from the table when there is
+# no usable model yet: none, an older file version, trees built with other settings (see
+# SameTrees()), features that are not those of the table at their current versions, or
+# clips resampled otherwise than the table's.
+# Returns (Model, Config), Model being a copy of the stored model configured with the query
+# Settings (see KNNModel.Configured()) and Config the stored model's
+def PatientModel(TrainingDir, Patient, ModelDir, **Settings):
+    Settings = ModelSettings(Settings)
+    TablePathname = TablePath(TrainingDir, Patient)
+    ModelPathname = ModelPath(ModelDir, Patient)
+    Model = None
+    Header = ModelHeader(ModelPathname) if os.path.isfile(ModelPathname) else None
+    if Header is not None and Header['version'] == FormatVersion:
+        Config = Header['config']
+        if not SameTrees(Config['settings'], Settings) or not FeaturesCurrent(Config, TableFeatures(TablePathname)) \
+           or not ResamplingCurrent(Config, TablePathname):
+            Model = None
+        elif os.path.getmtime(ModelPathname) < os.path.getmtime(TablePathname):
+            Model, Config = UpdateModel(TablePathname, ModelPathname, LoadModel(ModelPathname, Mapped=False)[0], Config)
+        else:
+            Model, Config = LoadModel(ModelPathname)
+    if Model is None:
+        os.makedirs(ModelDir, exist_ok=True)
+        Model, Config = CompileModel(TablePathname, ModelPathname, **Settings)
+    return(Model.Configured(**dict((Name, Settings[Name]) for Name in QuerySettings)), Config)
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3:
+        print('Usage: python ModelArtifact.py <training folder> <model folder>')
+        sys.exit(1)
+    os.makedirs(sys.argv[2], exist_ok=True)
+    for Patient in TablePatients(sys.argv[1]):
+        Model, Config = CompileModel(TablePath(sys.argv[1], Patient), ModelPath(sys.argv[2], Patient))
+        print('Compiled', Patient, 'from', len(Model.Labels), 'points')
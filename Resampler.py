@@ -1,46 +1,245 @@
-# Resampler (version 2)
+# Resampler (version 3)
+"""
+Resampler.py: Resample every clip of a data folder to a common sampling frequency.
+
+Clips are resampled along the sample axis only, all channels at once, and
+clips of the same shape and frequency are stacked and resampled together in
+one call.  The output length follows from the clip's duration and the output
+frequency (samples*outfreq/freq), so clips of any length keep their duration.
+
+Two resampling modes:
+
+    fft     scipy.signal.resample, the FFT method (the method of earlier
+            versions; exact for periodic signals, the default)
+    poly    scipy.signal.resample_poly, a polyphase FIR filter for rates whose
+            ratio is a small fraction (e.g. 5000 Hz -> 400 Hz is 2/25).  Its
+            cost grows linearly with the clip length, while the FFT method
+            slows down sharply on lengths with large prime factors.  Rates
+            whose ratio is not a fraction with terms up to MaxDenominator fall
+            back to fft
+
+Run from the command line with a source and a destination root to resample
+unattended: patient folders are processed in turn, their files spread across
+a process pool in batches, outputs that are newer than their input are
+skipped (so re-running after a partial data drop only does the new files),
+and each patient's throughput is reported.  Without the folders the script
+asks for them with Tk dialogs.
+
+    python Resampler.py E:/DATA E:/DATA400 --freq 400 --mode poly --workers 8
+
+Trainer.py and Classifier.py can instead resample in memory as they read the
+clips (their resamplefreq setting), through LoadResampledClip(), so no
+resampled copy of the data is written and read back unless one is asked for.
+"""
 
 import os
+import argparse
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+
 import scipy.io
 import scipy.signal
 import numpy as np
-from tkinter.filedialog import askdirectory
 
 import time
 
-dirpath = askdirectory()
-if dirpath == '':
-    print('Folder: None')
-    exit()
-
-newdir = askdirectory()
-
-outfreq = 400
-
-start = time.clock()
-
-for dn in os.listdir(dirpath):
-    dirstart = time.clock()
-    fullpath = os.path.join(dirpath, dn)
-    newpath = os.path.join(newdir, dn)
-    if not os.path.isdir(newpath):
-        os.mkdir(newpath)
-    if "Store" not in dn:
-        for fn in os.listdir(fullpath):
-            fullname = os.path.join(fullpath, fn)
-            newname = os.path.join(newpath, fn)
-            f = scipy.io.loadmat(fullname)
-            data = f['data']
-            infreq = f['freq']
-            
-            newdata = np.ndarray((data.shape[0], outfreq))
-            for i in range(0, len(data)):
-                newdata[i] = scipy.signal.resample(data[i], outfreq)
-
-            f['data'] = newdata
-            f['freq'] = outfreq
-
-            scipy.io.savemat(newname, f)
-    print("Processed", dn, "in", time.clock() - dirstart, "seconds")
-
-print("Processed all directories in", time.clock() - start, "seconds")
+# Largest up/down factor of a ratio the poly mode resamples with
+MaxDenominator = 1000
+
+# Resampling modes
+Modes = ('fft', 'poly')
+
+
+#
+# OutputLength()
+# Number of samples that keep the duration of Samples samples at Infreq when resampled to Outfreq
+def OutputLength(Samples, Infreq, Outfreq):
+    return(int(round(Samples*float(Outfreq)/float(Infreq))))
+
+
+#
+# PolyRatio()
+# (up, down) factors taking Infreq to Outfreq, None if the ratio is not a fraction with
+# small enough terms
+def PolyRatio(Infreq, Outfreq):
+    Ratio = Fraction(float(Outfreq)/float(Infreq)).limit_denominator(MaxDenominator)
+    if Ratio.numerator > MaxDenominator or abs(float(Ratio) - float(Outfreq)/float(Infreq)) > 1e-9:
+        return(None)
+    return(Ratio.numerator, Ratio.denominator)
+
+
+#
+# ResampleBatch()
+# Resample Data, shaped (..., samples), from Infreq to Outfreq along its last axis in one call.
+# Returns an array shaped (..., OutputLength())
+def ResampleBatch(Data, Infreq, Outfreq, Mode='fft'):
+    if Mode not in Modes:
+        raise ValueError('Unknown resampling mode ' + str(Mode))
+    Samples = Data.shape[-1]
+    Length = OutputLength(Samples, Infreq, Outfreq)
+    Ratio = PolyRatio(Infreq, Outfreq) if Mode == 'poly' else None
+    if Ratio is None:
+        return(scipy.signal.resample(Data, Length, axis=-1))
+
+    Up, Down = Ratio
+    Resampled = scipy.signal.resample_poly(Data, Up, Down, axis=-1)
+    if Resampled.shape[-1] >= Length:
+        return(Resampled[..., :Length])
+    Padding = [(0, 0)]*(Resampled.ndim - 1) + [(0, Length - Resampled.shape[-1])]
+    return(np.pad(Resampled, Padding, mode='edge'))
+
+
+#
+# ResampleClips()
+# Resample a list of clips (dicts read with scipy.io.loadmat) to Outfreq in place.  Clips with
+# the same data shape and frequency are stacked and resampled in one call
+def ResampleClips(Clips, Outfreq, Mode='fft'):
+    Groups = {}
+    for k, Clip in enumerate(Clips):
+        Key = (Clip['data'].shape, float(np.squeeze(Clip['freq'])))
+        Groups.setdefault(Key, []).append(k)
+
+    for (Shape, Infreq), Members in Groups.items():
+        Resampled = ResampleBatch(np.stack([Clips[k]['data'] for k in Members]), Infreq, Outfreq, Mode)
+        for j, k in enumerate(Members):
+            Clips[k]['data'] = Resampled[j]
+            Clips[k]['freq'] = Outfreq
+    return(Clips)
+
+
+#
+# UpToDate()
+# True if NewName exists and is newer than FullName
+def UpToDate(FullName, NewName):
+    return(os.path.isfile(NewName) and os.path.getmtime(NewName) >= os.path.getmtime(FullName))
+
+
+#
+# SaveClip()
+# Write a clip dict to NewName under a temporary name and then rename it, so an interrupted
+# write never leaves a partial file that looks up to date
+def SaveClip(NewName, Clip):
+    TempPath = NewName + '.tmp'
+    scipy.io.savemat(TempPath, Clip, appendmat=False)
+    os.replace(TempPath, NewName)
+
+
+#
+# LoadResampledClip()
+# Read a clip file and resample it to Outfreq in memory.  Returns (DataArray, Fsample, Latency)
+# like FeatureExplorer.LoadClip(), so it can stand in for it as the clip loader of
+# FeatureBatches().  With SaveDir the resampled clip is also written there under the same
+# file name, unless an up to date copy already is
+def LoadResampledClip(FullPath, Outfreq, Mode='fft', SaveDir=None):
+    Clip = ResampleClips([scipy.io.loadmat(FullPath)], Outfreq, Mode)[0]
+    if SaveDir is not None:
+        NewName = os.path.join(SaveDir, os.path.basename(FullPath))
+        if not UpToDate(FullPath, NewName):
+            os.makedirs(SaveDir, exist_ok=True)
+            SaveClip(NewName, Clip)
+    Latency = None
+    if 'latency' in Clip:
+        Latency = float(np.squeeze(Clip['latency']))
+    return(Clip['data'], float(Outfreq), Latency)
+
+
+#
+# ResampledCacheDir()
+# Feature cache folder for clips resampled to Outfreq with Mode, kept apart from CacheFolder
+# because the cache is keyed by the file the clip was read from, not by its sampling rate
+def ResampledCacheDir(CacheFolder, Outfreq, Mode='fft'):
+    return(os.path.join(CacheFolder, 'resampled %g Hz %s' % (Outfreq, Mode)))
+
+
+#
+# ResampleFiles()
+# Resample the clip files FileNames of FullPath into NewPath.  Process pool task of
+# ResampleAll().  Returns the number of input bytes read
+def ResampleFiles(FullPath, NewPath, FileNames, Outfreq, Mode='fft'):
+    Clips = ResampleClips([scipy.io.loadmat(os.path.join(FullPath, fn)) for fn in FileNames], Outfreq, Mode)
+    for fn, Clip in zip(FileNames, Clips):
+        SaveClip(os.path.join(NewPath, fn), Clip)
+    return(sum(os.path.getsize(os.path.join(FullPath, fn)) for fn in FileNames))
+
+
+#
+# ResampleFolder()
+# Resample every clip file of one patient folder into NewPath, BatchSize files at a time.
+# Files whose output is up to date are skipped unless Force is set.  With an Executor the
+# batches run on its process pool.  Returns (files resampled, files skipped, bytes read)
+def ResampleFolder(FullPath, NewPath, Outfreq, Mode='fft', BatchSize=64, Force=False, Executor=None):
+    if not os.path.isdir(NewPath):
+        os.mkdir(NewPath)
+    FileNames = []
+    Skipped = 0
+    for fn in sorted(os.listdir(FullPath)):
+        if not Force and UpToDate(os.path.join(FullPath, fn), os.path.join(NewPath, fn)):
+            Skipped += 1
+        else:
+            FileNames.append(fn)
+
+    Batches = [FileNames[First:First + BatchSize] for First in range(0, len(FileNames), BatchSize)]
+    if Executor is None:
+        Bytes = sum(ResampleFiles(FullPath, NewPath, Batch, Outfreq, Mode) for Batch in Batches)
+    else:
+        Tasks = [Executor.submit(ResampleFiles, FullPath, NewPath, Batch, Outfreq, Mode) for Batch in Batches]
+        Bytes = sum(Task.result() for Task in Tasks)
+    return(len(FileNames), Skipped, Bytes)
+
+
+#
+# ResampleAll()
+# Resample every patient folder of DirPath into NewDir on a pool of Workers processes,
+# printing each patient's throughput
+def ResampleAll(DirPath, NewDir, Outfreq, Mode='fft', Workers=None, BatchSize=64, Force=False):
+    if not os.path.isdir(NewDir):
+        os.makedirs(NewDir)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=Workers) as Executor:
+        for dn in sorted(os.listdir(DirPath)):
+            fullpath = os.path.join(DirPath, dn)
+            newpath = os.path.join(NewDir, dn)
+            if not os.path.isdir(fullpath):
+                continue
+            if "Store" in dn:
+                if not os.path.isdir(newpath):
+                    os.mkdir(newpath)
+                continue
+            dirstart = time.perf_counter()
+            Files, Skipped, Bytes = ResampleFolder(fullpath, newpath, Outfreq, Mode, BatchSize, Force, Executor)
+            Seconds = max(time.perf_counter() - dirstart, 1e-9)
+            print("Processed %s in %.1f seconds: %d files resampled (%.1f files/s, %.1f MB/s), %d up to date"
+                  % (dn, Seconds, Files, Files/Seconds, Bytes/Seconds/1e6, Skipped))
+    print("Processed all directories in", time.perf_counter() - start, "seconds")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resample every clip of a data folder to a common sampling frequency.')
+    parser.add_argument('source', nargs='?', help='folder of patient folders to resample (asked for when omitted)')
+    parser.add_argument('dest', nargs='?', help='folder receiving the resampled patient folders (asked for when omitted)')
+    parser.add_argument('--freq', type=float, default=400, help='output sampling frequency in Hz (default 400)')
+    parser.add_argument('--mode', choices=Modes, default='fft', help='resampling method (default fft)')
+    parser.add_argument('--workers', type=int, default=None, help='processes in the pool (default: one per CPU)')
+    parser.add_argument('--batch', type=int, default=64, help='files per pool task (default 64)')
+    parser.add_argument('--force', action='store_true', help='also rewrite outputs that are up to date')
+    args = parser.parse_args()
+
+    # ask for the folders that were not given
+    dirpath = args.source
+    newdir = args.dest
+    if dirpath is None or newdir is None:
+        from tkinter.filedialog import askdirectory
+
+        if dirpath is None:
+            dirpath = askdirectory()
+            if dirpath == '':
+                print('Folder: None')
+                exit()
+
+        newdir = askdirectory()
+        if newdir == '':
+            print('Folder: None')
+            exit()
+
+    outfreq = int(args.freq) if args.freq == int(args.freq) else args.freq
+    ResampleAll(dirpath, newdir, outfreq, args.mode, args.workers, args.batch, args.force)
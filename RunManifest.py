@@ -0,0 +1,83 @@
+"""
+RunManifest.py: Progress record of a batch run, so an interrupted run can resume.
+
+Trainer.py and Classifier.py process every patient's clips in a fixed (sorted)
+order.  After each batch is flushed to the output, they record in a manifest
+how many of the patient's clips are finished, whether the patient is done, and
+any other values needed to resume: per patient (such as the kind of run that
+wrote the entry and the length of its table) or for the whole run (such as
+the length of the output file).
+A restarted run skips the finished patients and clips and continues
+appending.
+
+The manifest is a small JSON file.  Every update writes it to a temporary file,
+syncs it to disk and renames it over the old one, so the manifest on disk is
+always complete and never ahead of the outputs it describes.
+
+    Manifest = RunManifest('E:/training results 5/trainer_manifest.json')
+    Clips, Done = Manifest.Progress('Dog_1')
+    Manifest.Record('Dog_1', Clips + 256)
+"""
+
+import os
+import json
+
+
+#####################################################################################
+# Run Manifest Class
+#####################################################################################
+class RunManifest():
+
+    #
+    # Class constructor, loads the manifest at ManifestPath.  Fresh discards any recorded
+    # progress and starts the run over
+    #
+    def __init__(self, ManifestPath, Fresh=False):
+        self.ManifestPath = ManifestPath
+        self.State = {'patients': {}}
+        if Fresh:
+            if os.path.isfile(ManifestPath):
+                os.remove(ManifestPath)
+        elif os.path.isfile(ManifestPath):
+            with open(ManifestPath) as ManifestFile:
+                self.State = json.load(ManifestFile)
+
+    #
+    # Progress(): (number of finished clips, done flag) of a patient
+    #
+    def Progress(self, Patient):
+        Entry = self.State['patients'].get(Patient, {})
+        return(Entry.get('clips', 0), Entry.get('done', False))
+
+    #
+    # Entry(): everything recorded for a patient (clips, done and its Details), empty if nothing
+    #
+    def Entry(self, Patient):
+        return(dict(self.State['patients'].get(Patient, {})))
+
+    #
+    # Get(): a value stored with Record(), Default if none has been
+    #
+    def Get(self, Name, Default=None):
+        return(self.State.get(Name, Default))
+
+    #
+    # Record(): the number of finished clips of a patient and whether it is done, plus a dict
+    # of Details kept with the patient's entry and any named Values for the whole run, then
+    # save the manifest
+    #
+    def Record(self, Patient, Clips, Done=False, Details=None, **Values):
+        self.State['patients'][Patient] = dict(Details or {}, clips=Clips, done=Done)
+        self.State.update(Values)
+        self.Save()
+
+    #
+    # Save(): write the manifest to a temporary file, sync it and rename it over the old one
+    #
+    def Save(self):
+        TempPath = self.ManifestPath + '.tmp'
+        with open(TempPath, 'w') as ManifestFile:
+            json.dump(self.State, ManifestFile)
+            ManifestFile.flush()
+            os.fsync(ManifestFile.fileno())
+        os.replace(TempPath, self.ManifestPath)
@@ -0,0 +1,102 @@
+"""
+StreamExtractor.py: Sliding-window feature extraction for continuous EEG.
+
+A StreamExtractor is fed multichannel sample blocks of any size, as they come
+off a recording, with Push().  It keeps the samples of the windows that are not
+complete yet between calls and, as soon as a window's last sample arrives,
+computes the requested features for it with the batch engine in
+FeatureEngine.py.  Every window is featurized exactly as a clip of the same
+length would be, so the outputs can be fed to the same kNN model as the
+one-second training clips.  Windows are Window samples long and start every
+Hop samples.
+
+    Stream = StreamExtractor(ModelFeatures, 400.0, Window=400, Hop=100)
+    for Block in Blocks:
+        Starts, Features = Stream.Push(Block)
+        Points = SummarizeFeatures(Features, ModelFeatures)
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import FeatureEngine
+from FeatureEngine import BatchFeatures
+
+
+#####################################################################################
+# Stream Extractor Class
+#####################################################################################
+class StreamExtractor():
+
+    #
+    # Class constructor.  Window and Hop are in samples; Window defaults to one second
+    # and Hop to Window (back to back windows)
+    #
+    def __init__(self, FENames, Fsample, Window=None, Hop=None):
+        self.FENames = list(FENames)
+        self.Fsample = float(Fsample)
+        self.Window = int(round(self.Fsample)) if Window is None else int(Window)
+        self.Hop = self.Window if Hop is None else int(Hop)
+        if self.Window < 2 or self.Hop < 1:
+            raise ValueError('Window must be at least 2 samples and Hop at least 1')
+
+        self.Buffer = None              #Samples not yet covered by an emitted window, shaped (channels, samples)
+        self.BufferStart = 0            #Stream index of the first sample in Buffer
+        self.NextStart = 0              #Stream index of the first sample of the next window
+
+    #
+    # Push(): add a (channels, samples) block to the stream.  Returns (Starts, Features) for the
+    # windows completed by this block: the stream index of the first sample of each window, and a
+    # dict of (windows, channels) ndarrays keyed by feature name (empty arrays when no window
+    # was completed)
+    #
+    def Push(self, Block):
+        Block = np.asarray(Block, dtype=FeatureEngine.ComputeDtype)
+        if self.Buffer is None:
+            self.Buffer = Block[:, :0]
+        self.Buffer = np.concatenate((self.Buffer, Block), axis=1)
+
+        First = self.NextStart - self.BufferStart                       #Offset of the next window in Buffer
+        Count = (self.Buffer.shape[1] - First - self.Window)//self.Hop + 1
+        if Count <= 0:
+            return(np.zeros(0, dtype=np.int64), self.Empty())
+
+        # (windows, channels, samples) view of the completed windows, no copy
+        Windows = sliding_window_view(self.Buffer[:, First:], self.Window, axis=1)[:, :(Count - 1)*self.Hop + 1:self.Hop]
+        Windows = Windows.transpose(1, 0, 2)
+        Features = BatchFeatures(self.FENames, Windows, self.Fsample)
+        Starts = self.NextStart + self.Hop*np.arange(Count, dtype=np.int64)
+
+        # Keep only the samples the next windows still need
+        self.NextStart += Count*self.Hop
+        Drop = min(self.NextStart - self.BufferStart, self.Buffer.shape[1])
+        self.Buffer = self.Buffer[:, Drop:].copy()
+        self.BufferStart += Drop
+        return(Starts, Features)
+
+    #
+    # Empty(): feature dict with no windows, returned when a block completes none
+    #
+    def Empty(self):
+        Channels = self.Buffer.shape[0]
+        return(dict((FEName, np.zeros((0, Channels))) for FEName in self.FENames))
+
+    #
+    # Reset(): forget the buffered samples and restart the window count at zero
+    #
+    def Reset(self):
+        self.Buffer = None
+        self.BufferStart = 0
+        self.NextStart = 0
+
+
+#
+# StreamFeatures()
+# Run a StreamExtractor over an iterable of blocks and yield (Starts, Features) for every
+# block that completes at least one window
+def StreamFeatures(Blocks, FENames, Fsample, Window=None, Hop=None):
+    Stream = StreamExtractor(FENames, Fsample, Window, Hop)
+    for Block in Blocks:
+        Starts, Features = Stream.Push(Block)
+        if Starts.size:
+            yield(Starts, Features)
@@ -8,24 +8,43 @@
     NOTE: replace std dev w/ IQR
 - signal energy following a bandpass between 10 and 20 Hz
 
-An output file is created for each segment containing a value for each feature
-and the segment's class.  These files are used for classification of new
-segments by Classifier.py."""
+A point is created for each segment containing a value for each feature and
+the segment's class.  The points of a patient are written to one feature table
+(see FeatureTable.py), which is used for classification of new segments by
+Classifier.py."""
 
-from FeatureExplorer import PeakDetect
-from FeatureExplorer import difChannelPeakDeviation
-from FeatureExplorer import difPeakDetect
-from FeatureExplorer import TenTwentyBPF
-from FeatureExplorer import TenThirtyBPFLL
+from FeatureExplorer import FeatureBatches
+from FeatureExplorer import IsEarly
+from FeatureExplorer import LoadClip
+from FeatureExplorer import CheckClipDtype
+from FeatureExplorer import CheckClipFreq
+from FeatureCache import PatientCache
+from FeatureCache import CacheDir
+from ClipStore import ClipStore
+from ClipStore import HasStore
+from ClipStore import reSegment
+from FeatureTable import FeatureTable
+from FeatureTable import TablePath
+from FeatureTable import LoadTable
+from FeatureTable import TableResampling
+from FeatureTable import RowKeys
+from FeatureTable import FileKey
+from RunManifest import RunManifest
+from FeatureEngine import SummarizeFeatures
+from FeatureEngine import ModelFeatures
+from FeatureEngine import SetComputeDtype
+from Resampler import LoadResampledClip
+from Resampler import ResampledCacheDir
 
 import matplotlib.pyplot as plt
 import scipy.io as sio
 import numpy as np
+import functools
 import string
 import time
 import os
 
-# location of .mat files
+# location of .mat files (the recordings as they are, when resamplefreq is set)
 dirpath = "E:/DATA/"
 
 # destination for output files
@@ -33,53 +52,178 @@ newdir = "E:/training results 5/"
 if not os.path.isdir(newdir):
     os.mkdir(newdir)
 
-start = time.clock()
+# number of clips featurized together
+batchsize = 256
 
-for dn in os.listdir(dirpath):
-    dirstart = time.clock()
+# threads reading the next clips while a batch is featurized, and the most clips
+# read ahead at once
+loadthreads = 4
+maxinflight = 256
+
+# folder holding the per-patient feature caches, shared with Classifier.py and
+# FeatureExplorer.py (set CacheDir in FeatureCache.py)
+cachedir = CacheDir
+
+# folder of packed per-patient clip stores (see ClipStore.py); None to read the
+# .mat files directly
+storedir = None
+
+# floating point type used for feature extraction; np.float32 halves the memory
+# traffic.  Its precision is checked against float64 on the first clips of every
+# patient, see CheckComputeDtype() in FeatureEngine.py
+computedtype = np.float64
+SetComputeDtype(computedtype)
+
+# sampling frequency every clip is resampled to in memory, as it is read and
+# before it is featurized, instead of featurizing a copy written by Resampler.py;
+# None featurizes the clips as they are.  Either way the clips must come out at
+# the filter bank's NativeFreq, which the features are tuned for (see
+# CheckClipFreq() in FeatureExplorer.py).  resamplemode is the Resampler.py mode.
+# resampledir also writes the resampled clips there, one folder per patient as
+# Resampler.py would; None keeps them in memory only.  Resampled clips are read
+# from the .mat files rather than the packed stores, and their features are
+# cached apart from those of the clips as they are
+resamplefreq = None
+resamplemode = 'fft'
+resampledir = None
+
+# how the clips are resampled, as recorded with the feature tables and the
+# manifest (see FeatureTable.py): tables and progress made at another setting are
+# not appended to or resumed from
+resampling = None if resamplefreq is None else [resamplefreq, resamplemode]
+
+# continue an interrupted run from its manifest (see RunManifest.py); False
+# starts over
+resume = True
+manifest = RunManifest(os.path.join(newdir, "trainer_manifest.json"), Fresh=not resume)
+
+# only featurize the clips that are new or have changed since they were added to
+# the patient's feature table, and append them to it (finished patients are
+# revisited); Classifier.py then updates the compiled models the same way
+incremental = False
+
+# kind of run recorded with each patient in the manifest; a resumed run only
+# trusts the progress of a run of its own kind
+runmode = "incremental" if incremental else "full"
+
+
+start = time.perf_counter()
+
+for dn in sorted(os.listdir(dirpath)):
+    dirstart = time.perf_counter()
     fullpath = os.path.join(dirpath, dn)
-    newpath = os.path.join(newdir, dn)
-    if not os.path.isdir(newpath):
-        os.mkdir(newpath)
+    
+    # skip the patients an earlier run finished, and the clips it finished of
+    # the patient it was working on
+    doneclips, done = manifest.Progress(dn)
+    entry = manifest.Entry(dn)
+    if entry.get('mode', 'full') != runmode:
+        doneclips = 0
+    if entry.get('resampling') != resampling:
+        doneclips, done = 0, False
+    if done and not incremental:
+        print("Skipping", dn, "(finished by an earlier run)")
+        continue
+    
     if 'Store' not in dn:
-        for fn in os.listdir(fullpath):
-            if "test" not in fn:
-                
-                # full path and filename of input file
-                fullname = os.path.join(fullpath, fn)
-                
-                # full path and filename of output file
-                newname = os.path.join(newpath, str.replace(fn, 'segment', 'point'))
-                
-                # detect feature for each channel
-                PD, early = PeakDetect(fullname)
-                dCPD = difChannelPeakDeviation(fullname)[0]
-                BPF = TenTwentyBPF(fullname)
-                
-                # take mean of channel values (dCPD is already std dev of channel
-                # values, so only contains one value)
-                #   NOTE: use median instead of mean
-                f1 = np.mean(PD)
-                f2 = dCPD
-                f3 = np.mean(BPF)
-                
-                data = [f1, f2, f3]
+        # the ictal and interictal clip files (not stray files such as the
+        # temporary files of an interrupted Resampler.py run)
+        fns = sorted(fn for fn in os.listdir(fullpath) if reSegment.match(fn) and "test" not in fn)
+        
+        # per-patient feature cache, so clips featurized by an earlier run are not loaded again
+        # (and the loader reading the uncached ones)
+        if resamplefreq is None:
+            cache = PatientCache(fullpath, cachedir)
+            load = LoadClip
+        else:
+            cache = PatientCache(fullpath, ResampledCacheDir(cachedir, resamplefreq, resamplemode))
+            load = functools.partial(LoadResampledClip, Outfreq=resamplefreq, Mode=resamplemode,
+                                     SaveDir=None if resampledir is None else os.path.join(resampledir, dn))
+        
+        # make sure the clips are featurized at the rate the features are tuned for,
+        # and that the features keep their precision in computedtype
+        if fns:
+            CheckClipFreq(os.path.join(fullpath, fns[0]), load)
+        if np.dtype(computedtype) != np.float64 and fns:
+            CheckClipDtype(ModelFeatures, [os.path.join(fullpath, fn) for fn in fns], computedtype, load)
+        
+        # read the clips from the patient's packed store when there is one
+        store = None
+        if storedir is not None and resamplefreq is None and HasStore(storedir, dn):
+            store = ClipStore(storedir, dn)
+        
+        # feature table receiving the patient's points.  Incremental runs keep the
+        # table and drop the clips it already holds, unchanged, from the list;
+        # resumed full runs cut the table back to the rows the manifest knows are
+        # complete and drop the clips of those rows from the list, so clips that
+        # arrived since are not skipped (the progress of an incremental run counts
+        # only the clips it picked, so it is not resumed from, see runmode)
+        tablepath = TablePath(newdir, dn)
+        if incremental and os.path.isfile(tablepath):
+            table = FeatureTable(tablepath)
+            known, tablefeatures = LoadTable(tablepath)
+            if tablefeatures != list(ModelFeatures):
+                raise ValueError("The table of " + dn + " holds other features: " + str(tablefeatures))
+            if table.Resampling != resampling:
+                raise ValueError("The table of " + dn + " was made with other resampling: " + str(table.Resampling))
+            knownmtimes = dict(zip(RowKeys(known).tolist(), known['mtime'].tolist()))
+            fns = [fn for fn in fns if knownmtimes.get(FileKey(fn)) != os.path.getmtime(os.path.join(fullpath, fn))]
+            doneclips = 0
+        elif doneclips and os.path.isfile(tablepath) and TableResampling(tablepath) == resampling:
+            table = FeatureTable(tablepath)
+            table.Truncate(entry.get('rows', doneclips))
+            finished = set(RowKeys(LoadTable(tablepath, Current=False)[0]).tolist())
+            fns = [fn for fn in fns if FileKey(fn) not in finished]
+        else:
+            doneclips = 0
+            table = FeatureTable(tablepath, ModelFeatures, resampling)
+        
+        # process the clips in batches so every feature is computed for all
+        # clips and channels of a batch at once; each uncached clip is loaded
+        # once, in the background while the previous batch is featurized
+        for batchpaths, features, latencies in FeatureBatches(ModelFeatures,
+                                                              [os.path.join(fullpath, fn) for fn in fns],
+                                                              batchsize, cache, store,
+                                                              loadthreads, maxinflight,
+                                                              load):
+            batchfns = [os.path.basename(path) for path in batchpaths]
+            
+            # reduce each feature to one value per clip: the mean of the channel
+            # values, or the single value of features like dCPD that are already
+            # a std dev of the channel values
+            #   NOTE: use median instead of mean
+            points = SummarizeFeatures(features, ModelFeatures)
+            
+            labels = []
+            segments = []
+            mtimes = []
+            for k, fn in enumerate(batchfns):
                 
                 # get segment class                
                 if "interictal" in fn:
                     typ = "i"
                 else:
-                    if early:
+                    if IsEarly(latencies[k]):
                         typ = 'e'
                     else:
                         typ = 'l'
-                        
-                # create dict for output file
-                point = {'data':data, 'type':typ}
+                labels.append(typ)
+                segments.append(int(reSegment.match(fn).group(3)))
+                mtimes.append(os.path.getmtime(batchpaths[k]))
                 
-                # save dict as a .mat file
-                sio.savemat(newname, point)
+            # append the batch's points to the table, then record them as finished
+            table.Append(points, labels, segments, mtimes)
+            doneclips += len(batchfns)
+            manifest.Record(dn, doneclips, Details={'mode': runmode, 'rows': table.Count(), 'resampling': resampling})
+        
+        rows = table.Count()
+        table.Close()
+        cache.Close()
+    else:
+        rows = 0
+    
+    manifest.Record(dn, doneclips, Done=True, Details={'mode': runmode, 'rows': rows, 'resampling': resampling})
                 
-    print("Processed", dn, "in", time.clock() - dirstart, "seconds.")
+    print("Processed", dn, "in", time.perf_counter() - dirstart, "seconds.")
 
-print("Processed all directories in", time.clock() - start, "seconds")
+print("Processed all directories in", time.perf_counter() - start, "seconds")